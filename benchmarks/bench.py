@@ -0,0 +1,320 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import platform
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+from asysocks.unicomm.common.scanner.common import ScannerData
+from pysnaffler import matchpool
+from pysnaffler._version import __version__
+from pysnaffler.ruleset import SnafflerRuleSet
+from pysnaffler.snaffler import pySnaffler
+from pysnaffler.scanner import SnafflerScanner
+from pysnaffler.whatif import evaluate_range, shard_file, run_shard, WhatifResult
+from benchmarks.synthetic import generate_entries, generate_directories, generate_shares, write_filelist, write_corpus, build_tree, ContentPool
+from benchmarks.localclient import LocalProtocolClient
+
+try:
+	import resource
+except ImportError:
+	# windows
+	resource = None
+
+BENCHMARKS = ['enum_share', 'enum_directory', 'enum_file', 'unroll_relays', 'enum_unc', 'whatif', 'parse_file', 'scanner']
+# enum_unc evaluates the paths in batches of this size, like whatif does
+UNC_BATCH_SIZE = 1000
+# a benchmark is reported as a regression if it got slower than the baseline by more than this
+REGRESSION_THRESHOLD = 0.1
+
+class BenchResult:
+	def __init__(self, name:str, items:int, elapsed:float, size:int = 0, peak_rss:int = 0, extra:Dict[str, int] = None):
+		self.name = name
+		self.items = items # files, paths or names processed
+		self.elapsed = elapsed
+		self.size = size # bytes processed, 0 if it doesn't apply
+		self.peak_rss = peak_rss
+		self.extra = extra if extra is not None else {}
+
+	@property
+	def items_per_sec(self) -> float:
+		return self.items / max(self.elapsed, 1e-9)
+
+	@property
+	def mb_per_sec(self) -> float:
+		return self.size / max(self.elapsed, 1e-9) / (1024*1024)
+
+	def to_dict(self):
+		return {
+			'name' : self.name,
+			'items' : self.items,
+			'elapsed' : self.elapsed,
+			'size' : self.size,
+			'peak_rss' : self.peak_rss,
+			'items_per_sec' : self.items_per_sec,
+			'mb_per_sec' : self.mb_per_sec,
+			'extra' : self.extra,
+		}
+
+	@staticmethod
+	def from_dict(d:dict):
+		return BenchResult(d['name'], d['items'], d['elapsed'], d.get('size', 0), d.get('peak_rss', 0), d.get('extra'))
+
+def peak_rss() -> int:
+	"""Peak resident set size of this process in bytes, 0 if unknown"""
+	if resource is None:
+		return 0
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		return rss
+	return rss * 1024
+
+def split_unc(unc_path:str) -> Tuple[str, str]:
+	"""Returns the path inside the share and the name of a file, as the file rules see them"""
+	parts = unc_path[2:].split('\\')
+	return '\\'.join(parts[2:]), parts[-1]
+
+def bench_enum_share(args) -> BenchResult:
+	ruleset = SnafflerRuleSet.load_default_ruleset()
+	shares = generate_shares(args.shares, args.seed)
+	start = time.perf_counter()
+	for name in shares:
+		ruleset.enum_share(name)
+	return BenchResult('enum_share', len(shares), time.perf_counter() - start)
+
+def bench_enum_directory(args) -> BenchResult:
+	ruleset = SnafflerRuleSet.load_default_ruleset()
+	directories = generate_directories(args.directories, args.seed)
+	start = time.perf_counter()
+	for directory in directories:
+		ruleset.enum_directory(directory)
+	return BenchResult('enum_directory', len(directories), time.perf_counter() - start)
+
+def bench_enum_file(args) -> BenchResult:
+	ruleset = SnafflerRuleSet.load_default_ruleset()
+	files = [split_unc(unc_path) + (size,) for unc_path, size in generate_entries(args.paths, args.seed)]
+	matched = 0
+	start = time.perf_counter()
+	for fullpath, name, size in files:
+		if ruleset.enum_file(None, fullpath, name, size)[0] is True:
+			matched += 1
+	return BenchResult('enum_file', len(files), time.perf_counter() - start, extra = {'matched' : matched})
+
+def bench_unroll_relays(args) -> BenchResult:
+	ruleset = SnafflerRuleSet.load_default_ruleset()
+	matches = []
+	for unc_path, size in generate_entries(args.paths, args.seed):
+		fullpath, name = split_unc(unc_path)
+		to_dl, rules = ruleset.enum_file(None, fullpath, name, size)
+		if to_dl is True:
+			matches.append(rules)
+	ruleset.unrollCache = {}
+	start = time.perf_counter()
+	for rules in matches:
+		ruleset.unroll_relays(rules)
+	return BenchResult('unroll_relays', len(matches), time.perf_counter() - start, extra = {'combinations' : len(ruleset.unrollCache)})
+
+def bench_enum_unc(args) -> BenchResult:
+	ruleset = SnafflerRuleSet.load_default_ruleset()
+	entries = list(generate_entries(args.paths, args.seed))
+	matched = 0
+	start = time.perf_counter()
+	for i in range(0, len(entries), UNC_BATCH_SIZE):
+		for to_dl, _, _ in ruleset.enum_unc_batch(entries[i:i+UNC_BATCH_SIZE]):
+			if to_dl is True:
+				matched += 1
+	return BenchResult('enum_unc', len(entries), time.perf_counter() - start, extra = {'matched' : matched})
+
+async def run_whatif(ruleset:SnafflerRuleSet, path:str, workers:int) -> WhatifResult:
+	"""Same as pysnaffler.whatif.whatif without the printing"""
+	if workers <= 1:
+		return evaluate_range(ruleset, path, 0, os.path.getsize(path))
+	loop = asyncio.get_running_loop()
+	result = WhatifResult()
+	with ProcessPoolExecutor(workers, initializer = matchpool.init_worker, initargs = (ruleset.pickle(),)) as executor:
+		jobs = [run_shard(loop, executor, 0, path, start, end, False) for start, end in shard_file(path, min_shards = workers)]
+		for job in asyncio.as_completed(jobs):
+			_, _, shard = await job
+			result.merge(shard)
+	return result
+
+def bench_whatif(args) -> BenchResult:
+	ruleset = SnafflerRuleSet.load_default_ruleset()
+	path = os.path.join(args.workdir, 'filelist_%s_%s.tsv' % (args.paths, args.seed))
+	if os.path.isfile(path) is False:
+		write_filelist(path, args.paths, args.seed)
+	start = time.perf_counter()
+	result = asyncio.run(run_whatif(ruleset, path, args.workers))
+	elapsed = time.perf_counter() - start
+	return BenchResult('whatif', args.paths, elapsed, os.path.getsize(path), extra = {'files_to_dl' : len(result.files_to_dl), 'workers' : args.workers})
+
+async def parse_corpus(ruleset:SnafflerRuleSet, corpus:List[Tuple[str, str, int]]) -> int:
+	found = 0
+	for path, name, size in corpus:
+		to_dl, rules = ruleset.enum_file(None, name, name, size)
+		if to_dl is False:
+			continue
+		async for res, _, err in ruleset.parse_file(path, rules, size):
+			if err is None and res is not None:
+				found += 1
+	return found
+
+def bench_parse_file(args) -> BenchResult:
+	ruleset = SnafflerRuleSet.load_default_ruleset()
+	corpus = write_corpus(os.path.join(args.workdir, 'corpus_%s_%s' % (args.corpus_files, args.seed)), args.corpus_files, args.seed)
+	start = time.perf_counter()
+	found = asyncio.run(parse_corpus(ruleset, corpus))
+	elapsed = time.perf_counter() - start
+	return BenchResult('parse_file', len(corpus), elapsed, sum(size for _, _, size in corpus), extra = {'matches' : found})
+
+async def scan_hosts(args) -> BenchResult:
+	snaffler = pySnaffler(
+		SnafflerRuleSet.load_default_ruleset(),
+		download_base_dir = os.path.join(args.workdir, 'downloads'),
+		in_memory_max_size = args.in_memory,
+		match_workers = args.match_workers,
+	)
+	tree = build_tree(generate_entries(args.scan_files, args.seed, args.scan_hosts))
+	contents = ContentPool(args.seed)
+	scanner = SnafflerScanner(None, snaffler)
+	out_queue = asyncio.Queue(snaffler.out_queue_size)
+	results = 0
+
+	async def drain():
+		nonlocal results
+		while True:
+			item = await out_queue.get()
+			if isinstance(item, ScannerData):
+				results += 1
+
+	drain_task = asyncio.create_task(drain())
+	try:
+		start = time.perf_counter()
+		await asyncio.gather(*[scanner.snaffle_machine(LocalProtocolClient(None, host, tree, contents, args.latency), host, host, out_queue) for host in tree])
+		elapsed = time.perf_counter() - start
+	finally:
+		drain_task.cancel()
+		snaffler.close()
+	metrics = snaffler.metrics
+	return BenchResult('scanner', sum(x.objects for x in metrics.hosts.values()), elapsed, metrics.download_bytes, extra = {
+		'hosts' : len(tree),
+		'files_processed' : sum(x.files for x in metrics.hosts.values()),
+		'results' : results,
+	})
+
+def bench_scanner(args) -> BenchResult:
+	return asyncio.run(scan_hosts(args))
+
+def run_benchmark(name:str, args) -> dict:
+	result = globals()['bench_%s' % name](args)
+	result.peak_rss = peak_rss()
+	return result.to_dict()
+
+def run_isolated(name:str, args) -> BenchResult:
+	"""Runs the benchmark in a fresh process, so the peak RSS is its own"""
+	with ProcessPoolExecutor(1, mp_context = multiprocessing.get_context('spawn')) as executor:
+		return BenchResult.from_dict(executor.submit(run_benchmark, name, args).result())
+
+def format_size(size:float) -> str:
+	for unit in ['B', 'KB', 'MB', 'GB']:
+		if size < 1024:
+			return '%.1f%s' % (size, unit)
+		size /= 1024
+	return '%.1fTB' % size
+
+def print_results(results:List[BenchResult], baseline:Dict[str, BenchResult] = None, threshold:float = REGRESSION_THRESHOLD) -> List[str]:
+	"""Prints the results table, compared to the baseline if given. Returns the names of the regressed benchmarks"""
+	regressions = []
+	print('%-15s %10s %10s %12s %10s %10s  %s' % ('benchmark', 'items', 'seconds', 'items/s', 'MB/s', 'peak RSS', 'vs baseline'))
+	for result in results:
+		change = ''
+		if baseline is not None and result.name in baseline:
+			old = baseline[result.name].items_per_sec
+			ratio = result.items_per_sec / old - 1 if old > 0 else 0.0
+			change = '%+.1f%%' % (ratio * 100)
+			if ratio < -threshold:
+				change += ' REGRESSION'
+				regressions.append(result.name)
+		mbps = '%.1f' % result.mb_per_sec if result.size > 0 else '-'
+		print('%-15s %10d %10.3f %12.1f %10s %10s  %s' % (result.name, result.items, result.elapsed, result.items_per_sec, mbps, format_size(result.peak_rss), change))
+		if len(result.extra) > 0:
+			print('%-15s %s' % ('', ' '.join('%s=%s' % (k, v) for k, v in result.extra.items())))
+	return regressions
+
+def data_args(args) -> dict:
+	"""Arguments that change what the benchmarks measure"""
+	return {k : v for k, v in vars(args).items() if k not in ('benchmarks', 'workdir', 'no_isolation', 'json', 'baseline', 'threshold')}
+
+def main():
+	import argparse
+
+	parser = argparse.ArgumentParser(description='pySnaffler benchmarks. Runs the rule engine, whatif and the scanner on synthetic data, against the default ruleset')
+	parser.add_argument('benchmarks', nargs='*', help='Benchmarks to run, all of them if not set. Available: %s' % ', '.join(BENCHMARKS))
+	parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic data, same seed gives the same data')
+	parser.add_argument('--paths', type=int, default=1000000, help='Number of file paths for enum_file, unroll_relays, enum_unc and whatif')
+	parser.add_argument('--directories', type=int, default=200000, help='Number of directory paths for enum_directory')
+	parser.add_argument('--shares', type=int, default=100000, help='Number of share names for enum_share')
+	parser.add_argument('--corpus-files', type=int, default=200, help='Number of files in the parse_file corpus')
+	parser.add_argument('--scan-files', type=int, default=5000, help='Number of files on the in-process servers of the scanner benchmark')
+	parser.add_argument('--scan-hosts', type=int, default=4, help='Number of in-process servers of the scanner benchmark')
+	parser.add_argument('--latency', type=float, default=0, help='Seconds added to every directory listing and file read of the in-process servers')
+	parser.add_argument('--in-memory', type=int, default=1024*1024, help='Files up to this size are scanned in memory by the scanner benchmark (see pysnaffler -m)')
+	parser.add_argument('--match-workers', type=int, default=0, help='Contents matching workers of the scanner benchmark (see pysnaffler --match-workers)')
+	parser.add_argument('-w', '--workers', type=int, default=1, help='Worker processes of the whatif benchmark')
+	parser.add_argument('--workdir', help='Directory for the generated filelists, corpora and downloads. A temporary directory is used if not set')
+	parser.add_argument('--no-isolation', action='store_true', help='Run all benchmarks in this process (eg. under a profiler). Peak RSS is then the peak of all benchmarks so far')
+	parser.add_argument('--json', help='Write the results to this file')
+	parser.add_argument('--baseline', help='Results file (--json) of an earlier run, benchmarks slower than it by more than --threshold are reported as regressions')
+	parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='Allowed slowdown compared to the baseline, 0.1 means 10%%')
+	args = parser.parse_args()
+
+	names = args.benchmarks if len(args.benchmarks) > 0 else BENCHMARKS
+	for name in names:
+		if name not in BENCHMARKS:
+			print('Unknown benchmark %s! Available: %s' % (name, ', '.join(BENCHMARKS)))
+			return 2
+
+	baseline = None
+	if args.baseline is not None:
+		with open(args.baseline, 'r') as f:
+			data = json.load(f)
+		baseline = {d['name'] : BenchResult.from_dict(d) for d in data['results']}
+		if data.get('args', {}) != data_args(args):
+			print('Warning: the baseline was run with different parameters, the comparison is not meaningful')
+
+	tempdir = None
+	if args.workdir is None:
+		tempdir = tempfile.TemporaryDirectory(prefix = 'pysnaffler_bench_')
+		args.workdir = tempdir.name
+	os.makedirs(args.workdir, exist_ok = True)
+
+	results = []
+	try:
+		for name in names:
+			print('Running %s...' % name, file = sys.stderr)
+			if args.no_isolation is True:
+				results.append(BenchResult.from_dict(run_benchmark(name, args)))
+			else:
+				results.append(run_isolated(name, args))
+	finally:
+		if tempdir is not None:
+			tempdir.cleanup()
+
+	print('pySnaffler %s, Python %s, %s' % (__version__, platform.python_version(), platform.platform()))
+	regressions = print_results(results, baseline, args.threshold)
+	if args.json is not None:
+		with open(args.json, 'w') as f:
+			json.dump({
+				'version' : __version__,
+				'python' : platform.python_version(),
+				'platform' : platform.platform(),
+				'args' : data_args(args),
+				'results' : [result.to_dict() for result in results],
+			}, f, indent = 4)
+	if len(regressions) > 0:
+		print('Regressions: %s' % ', '.join(regressions))
+		return 1
+	return 0
@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+from pathlib import Path
+from typing import Dict
+from aiosmb.commons.interfaces.share import SMBShare
+from aiosmb.commons.interfaces.directory import SMBDirectory
+from aiosmb.commons.interfaces.file import SMBFile
+from pysnaffler.protocol import ProtocolClient
+from benchmarks.synthetic import ContentPool
+
+# read size of the stand-in, same as the SMB/NFS default
+READ_SIZE = 1024*1024
+FILE_TIME = datetime.datetime(2023, 1, 1, tzinfo = datetime.timezone.utc)
+
+class LocalProtocolClient(ProtocolClient):
+	"""In-process stand-in for the SMB/NFS clients, serves a synthetic tree (see synthetic.build_tree)
+	with contents cut from a ContentPool. Enumeration calls the filter the same way SMBMachine does:
+	'sharename' and 'share' before a share is entered, 'dir' before a directory is entered.
+	latency (seconds) is added to every directory listing and file read to imitate a network round-trip"""
+	def __init__(self, factory, target, tree:Dict[str, dict] = None, contents:ContentPool = None, latency:float = 0):
+		self.factory = factory
+		self.target = target
+		self.tree = tree if tree is not None else {}
+		self.contents = contents if contents is not None else ContentPool()
+		self.latency = latency
+
+	async def connect_to_target(self, target):
+		self.target = target
+
+	async def __wait(self):
+		if self.latency > 0:
+			await asyncio.sleep(self.latency)
+
+	async def donwload_file(self, file:SMBFile, localpath, max_size):
+		localpath = Path(localpath)
+		if localpath.is_dir():
+			localpath = localpath.joinpath(file.name)
+		with open(localpath, 'wb') as f:
+			async for data, err in self.read_file_chunked(file, max_size):
+				if err is not None:
+					return None, err
+				f.write(data)
+		return str(localpath.absolute()), None
+
+	async def read_file_chunked(self, file:SMBFile, max_size):
+		offset = 0
+		remaining = min(file.size, max_size)
+		while remaining > 0:
+			await self.__wait()
+			data = self.contents.read(file.unc_path, offset, min(READ_SIZE, remaining))
+			offset += len(data)
+			remaining -= len(data)
+			yield data, None
+
+	def __create_file(self, unc_path:str, fullpath:str, name:str, size:int) -> SMBFile:
+		obj = SMBFile()
+		obj.unc_path = unc_path
+		obj.fullpath = fullpath
+		obj.name = name
+		obj.size = size
+		obj.creation_time = FILE_TIME
+		obj.last_write_time = FILE_TIME
+		return obj
+
+	def __create_directory(self, unc_path:str, fullpath:str, name:str) -> SMBDirectory:
+		obj = SMBDirectory()
+		obj.unc_path = unc_path
+		obj.fullpath = fullpath
+		obj.name = name
+		obj.creation_time = FILE_TIME
+		return obj
+
+	async def __list_r(self, node:dict, unc_path:str, fullpath:str, filter):
+		await self.__wait()
+		for name, entry in node.items():
+			await asyncio.sleep(0)
+			entrypath = fullpath + '\\' + name if fullpath != '' else name
+			if isinstance(entry, dict):
+				obj = self.__create_directory(unc_path + '\\' + name, entrypath, name)
+				yield obj, 'dir', None
+				if await filter('dir', obj) is False:
+					continue
+				async for res in self.__list_r(entry, obj.unc_path, entrypath, filter):
+					yield res
+			else:
+				yield self.__create_file(unc_path + '\\' + name, entrypath, name, entry), 'file', None
+
+	async def enum_files_with_filter(self, filter):
+		shares = self.tree.get(str(self.target), {})
+		for name in shares:
+			yield SMBShare(name = name, fullpath = '\\\\%s\\%s' % (self.target, name)), 'share', None
+		for name, root in shares.items():
+			if await filter('sharename', name) is False:
+				continue
+			share = SMBShare(name = name, fullpath = '\\\\%s\\%s' % (self.target, name))
+			if await filter('share', share) is False:
+				continue
+			async for res in self.__list_r(root, share.fullpath, '', filter):
+				yield res
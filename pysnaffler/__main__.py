@@ -7,6 +7,7 @@ from aiosmb.commons.connection.factory import SMBConnectionFactory
 from pysnaffler.snaffler import pySnaffler
 from pysnaffler.ruleset import SnafflerRuleSet
 from pysnaffler.scanner import SnafflerScanner
+from pysnaffler.output import SnafflerOutput, scan_and_write, pyarrow, OUTPUT_FORMATS, OUTPUT_FLUSH_INTERVAL
 from aiosmb import logger
 
 from anfs.protocol.nfs3.common.factory import NFS3ConnectionFactory
@@ -23,6 +24,13 @@ async def amain():
 	parser.add_argument('-t', '--timeout', type=int, default=36000, help='Timeout for each connection. dangerous!')
 	parser.add_argument('--no-progress', action='store_false', help='Disable progress bar')
 	parser.add_argument('-o', '--out-file', help='Output file path.')
+	parser.add_argument('--output-format', choices=OUTPUT_FORMATS, default='tsv', help='Format of the output files. parquet needs the pyarrow package and is meant for large filelists (-l)')
+	parser.add_argument('--flush-interval', type=float, default=OUTPUT_FLUSH_INTERVAL, help='Seconds between flushes of the buffered output files')
+	parser.add_argument('--queue-size', type=int, default=10000, help='Max number of results waiting to be written. Enumeration slows down when the output falls behind. 0 means unbounded')
+	parser.add_argument('--info-interval', type=float, default=1, help='Seconds between progress messages of a host, the rest are skipped. 0 sends all of them')
+	parser.add_argument('--stats-interval', type=float, default=0, help='Print a line of scan statistics (rates, rule evaluation time, queue depths) every this many seconds. 0 disables')
+	parser.add_argument('--metrics-file', help='Write a snapshot of the scan metrics to this file periodically and at the end. JSON, or Prometheus text format if the name ends with .prom')
+	parser.add_argument('--profile-rules', action='store_true', help='Time every pattern of every rule, prints the slowest ones and the patterns prone to backtracking at the end. Slows down the matching')
 	parser.add_argument('-e', '--errors', action='store_true', help='Includes errors in output.')
 	parser.add_argument('-d', '--dry-run', action='store_true', help='Dry run. Enumeration only, gives stats on what would be downloaded/checked etc.')
 	parser.add_argument('-l', '--filelist', action='store_true', help='Generates filelist file containing a list of files and folders enumerated')
@@ -30,6 +38,17 @@ async def amain():
 	parser.add_argument('-b', '--base-path', default = 'snaffler_downloads', help='Base directory path for downloaded files')
 	parser.add_argument('--chars-before-match', type=int, default=0, help='Number of characters to show in output file before a match')
 	parser.add_argument('--chars-after-match', type=int, default=0, help='Number of characters to show in output file after a match')
+	parser.add_argument('-m', '--in-memory', type=int, default=0, help='Files up to this size are read into memory and parsed there instead of downloading them to disk. 0 disables')
+	parser.add_argument('--first-match', action='store_true', help='Stop scanning a file for a rule after its first match')
+	parser.add_argument('--max-scan-bytes', type=int, default=0, help='Scan at most this many bytes of each file. Files larger than --maxfile are scanned by their head instead of being skipped. 0 disables')
+	parser.add_argument('--match-workers', type=int, default=0, help='Number of workers running the contents matching outside of the network event loop. 0 disables')
+	parser.add_argument('--match-backend', choices=['process', 'thread'], default='process', help='Worker type used by --match-workers')
+	parser.add_argument('--journal', help='Path to the scan journal file. Finished hosts, directories and files are recorded here')
+	parser.add_argument('--resume', action='store_true', help='Resume the scan recorded in the journal, skipping everything finished already')
+	parser.add_argument('--index', help='Path to the incremental scan index file. Files unchanged (size and last write time) since the previous scan are not downloaded again, their previous results are reported')
+	parser.add_argument('--dedup-cache', type=int, default=0, help='Number of distinct file contents (by hash) to remember. Files with already seen contents are not matched again, the previous results are reported. 0 disables')
+	parser.add_argument('--archive-max-size', type=int, default=256*1024*1024, help='Max total uncompressed bytes read from an archive opened by an EnterArchive rule, including nested archives')
+	parser.add_argument('--archive-max-depth', type=int, default=3, help='Max nesting depth of archives opened by EnterArchive rules')
 	parser.add_argument('-n', '--nfs', action='store_true', help='Use NFS instead of SMB to access files on the server')
 	parser.add_argument('-c', '--config', help='Path to config file. Overrides all other options.')
 	parser.add_argument('url', help = 'Connection string in URL format')
@@ -39,6 +58,12 @@ async def amain():
 	if len(args.targets) == 0:
 		print('No targets defined!')
 		return
+	if args.resume is True and args.journal is None:
+		print('Resuming needs a journal file! (--journal)')
+		return
+	if args.output_format == 'parquet' and pyarrow is None:
+		print('Parquet output needs the pyarrow package!')
+		return
 	
 	logger.setLevel(logging.CRITICAL)
 	
@@ -46,9 +71,10 @@ async def amain():
 	if args.config is not None:
 		snaffler = pySnaffler.from_config_file(args.config)
 	else:
-		ruleset = SnafflerRuleSet.load_default_ruleset()
 		if args.rules is not None:
 			ruleset = SnafflerRuleSet.from_directory(args.rules)
+		else:
+			ruleset = SnafflerRuleSet.load_default_ruleset()
 		
 		snaffler = pySnaffler(
 			ruleset, 
@@ -62,7 +88,21 @@ async def amain():
 			args.filelist,
 			args.chars_before_match,
 			args.chars_after_match,
-			args.nfs
+			args.nfs,
+			args.in_memory,
+			args.first_match,
+			args.max_scan_bytes,
+			args.match_workers,
+			args.match_backend,
+			args.journal,
+			args.resume,
+			args.index,
+			args.dedup_cache,
+			args.archive_max_size,
+			args.archive_max_depth,
+			args.queue_size,
+			args.info_interval,
+			args.profile_rules
 		)
 
 	if snaffler.nfs:
@@ -75,7 +115,21 @@ async def amain():
 	executors = [SnafflerScanner(connectionfactory, snaffler)]
 	tgen = UniTargetGen.from_list(args.targets)
 	scanner = UniScanner('Snaffler', executors, [tgen], worker_count=args.worker_count, host_timeout=timeout)
-	await scanner.scan_and_process(progress=args.no_progress, out_file=args.out_file, include_errors=args.errors)
+	# results backpressure the scan instead of piling up in memory when the output is slow
+	scanner.out_queue = asyncio.Queue(snaffler.out_queue_size)
+	output = SnafflerOutput(args.out_file, scanner.name, scanner.scantime, args.output_format, args.flush_interval, args.errors)
+	metrics_task = None
+	if args.stats_interval > 0 or args.metrics_file is not None:
+		interval = args.stats_interval if args.stats_interval > 0 else 10
+		metrics_task = asyncio.create_task(snaffler.metrics.report_periodically(interval, args.metrics_file, args.stats_interval > 0))
+	try:
+		await scan_and_write(scanner, output, progress=args.no_progress)
+	finally:
+		if metrics_task is not None:
+			metrics_task.cancel()
+		if args.metrics_file is not None:
+			snaffler.metrics.write_snapshot(args.metrics_file)
+		snaffler.close()
 	snaffler.clean_working_directory()
 	snaffler.print_stats()
 
@@ -0,0 +1,201 @@
+import io
+import bz2
+import lzma
+import gzip
+import tarfile
+import zipfile
+from typing import Iterator, List, Tuple
+
+try:
+	import py7zr
+	try:
+		from py7zr.io import BytesIOFactory
+	except ImportError:
+		# py7zr < 1.0, members are read with SevenZipFile.read
+		BytesIOFactory = None
+except ImportError:
+	py7zr = None
+
+# archives inside archives are opened up to this depth
+ARCHIVE_MAX_DEPTH = 3
+# total uncompressed bytes read from an archive, including nested archives
+ARCHIVE_MAX_TOTAL_SIZE = 256*1024*1024
+# total number of members evaluated in an archive, including nested archives
+ARCHIVE_MAX_MEMBERS = 10000
+# members are decompressed in chunks of this size
+ARCHIVE_CHUNK_SIZE = 1024*1024
+
+# zip (also docx/xlsx/jar...), 7z, and the compressions tarfile handles
+ZIP_MAGICS = [b'PK\x03\x04', b'PK\x05\x06']
+SEVENZIP_MAGIC = b'7z\xbc\xaf\x27\x1c'
+COMPRESSED_MAGICS = {
+	b'\x1f\x8b' : gzip.open,
+	b'BZh' : bz2.open,
+	b'\xfd7zXZ\x00' : lzma.open,
+}
+
+class ArchiveSkipped(Exception):
+	"""The archive (or the rest of it) is not opened, eg. unknown format or limits reached.
+	Not a read error, the file is reported as skipped"""
+	pass
+
+class ArchiveLimits:
+	"""Limits shared by an archive and all archives nested in it, protects against decompression bombs"""
+	def __init__(self, max_depth:int = ARCHIVE_MAX_DEPTH, max_total_size:int = ARCHIVE_MAX_TOTAL_SIZE, max_members:int = ARCHIVE_MAX_MEMBERS):
+		self.max_depth = max_depth
+		self.remaining = max_total_size
+		self.members = max_members
+
+	def take(self, size:int) -> int:
+		"""Reserves up to size bytes of the budget, returns the reserved amount"""
+		size = min(size, self.remaining)
+		self.remaining -= size
+		return size
+
+class ArchiveMember:
+	__slots__ = ('path', 'size', 'opener')
+	def __init__(self, path:str, size:int, opener):
+		self.path = path # path inside the archive, backslash separated
+		self.size = size # uncompressed size, as declared by the archive
+		self.opener = opener # returns a file object of the member's contents
+
+	def open(self):
+		return self.opener()
+
+def member_path(name:str) -> str:
+	return '\\'.join([x for x in name.replace('/', '\\').split('\\') if x != '' and x != '.' and x != '..'])
+
+def archive_type(head:bytes) -> str:
+	"""Returns the archive type by the first bytes of the file, None if it's not a known archive"""
+	for magic in ZIP_MAGICS:
+		if head.startswith(magic):
+			return 'zip'
+	if head.startswith(SEVENZIP_MAGIC):
+		return '7z'
+	if len(head) > 262 and head[257:262] == b'ustar':
+		return 'tar'
+	for magic in COMPRESSED_MAGICS:
+		if head.startswith(magic):
+			return 'compressed'
+	return None
+
+def iter_zip(fileobj) -> Iterator[ArchiveMember]:
+	with zipfile.ZipFile(fileobj) as zf:
+		for info in zf.infolist():
+			if info.is_dir() is True:
+				continue
+			yield ArchiveMember(member_path(info.filename), info.file_size, lambda info=info: zf.open(info))
+
+def iter_tar(fileobj) -> Iterator[ArchiveMember]:
+	with tarfile.open(fileobj=fileobj, mode='r:*') as tf:
+		for info in tf:
+			if info.isfile() is False:
+				continue
+			yield ArchiveMember(member_path(info.name), info.size, lambda info=info: tf.extractfile(info))
+
+def iter_compressed(fileobj, name:str) -> Iterator[ArchiveMember]:
+	"""Single compressed file, or a compressed tar"""
+	try:
+		with tarfile.open(fileobj=fileobj, mode='r:*') as tf:
+			for info in tf:
+				if info.isfile() is False:
+					continue
+				yield ArchiveMember(member_path(info.name), info.size, lambda info=info: tf.extractfile(info))
+		return
+	except tarfile.ReadError:
+		fileobj.seek(0)
+	head = fileobj.read(6)
+	fileobj.seek(0)
+	for magic, opener in COMPRESSED_MAGICS.items():
+		if head.startswith(magic):
+			# the member is named after the archive without its extension, the size is not known up front
+			inner = name.rsplit('.', 1)[0] if name.find('.') != -1 else name
+			yield ArchiveMember(inner, -1, lambda opener=opener: opener(fileobj))
+			return
+
+def iter_7z(fileobj) -> Iterator[ArchiveMember]:
+	if py7zr is None:
+		raise Exception('7z archives need the py7zr package')
+	with py7zr.SevenZipFile(fileobj, 'r') as zf:
+		for info in zf.list():
+			if info.is_directory is True:
+				continue
+			def opener(name = info.filename, size = info.uncompressed):
+				# py7zr can only decompress to memory, the size is checked against the limits before this is called
+				return read_7z_member(zf, name, size)
+			yield ArchiveMember(member_path(info.filename), info.uncompressed, opener)
+
+def read_7z_member(zf, name:str, size:int) -> io.BytesIO:
+	"""Decompresses a single member of a 7z archive to memory.
+	py7zr 1.0 replaced SevenZipFile.read with extract(factory=...)"""
+	zf.reset()
+	if BytesIOFactory is None:
+		return zf.read([name])[name]
+	factory = BytesIOFactory(max(size, 1))
+	zf.extract(targets=[name], factory=factory)
+	if name not in factory.products:
+		# empty members are not extracted
+		return io.BytesIO()
+	product = factory.get(name)
+	product.seek(0)
+	return io.BytesIO(product.read())
+
+def iter_archive(name:str, filepath:str = None, data:bytes = None) -> Tuple[Iterator[ArchiveMember], Exception]:
+	"""Returns an iterator over the regular file members of an archive on disk or in memory.
+	Members are decompressed only when opened, one at a time"""
+	try:
+		if data is not None:
+			fileobj = io.BytesIO(data)
+		else:
+			fileobj = open(filepath, 'rb')
+		head = fileobj.read(512)
+		fileobj.seek(0)
+		atype = archive_type(head)
+		if atype is None:
+			fileobj.close()
+			return None, ArchiveSkipped('Skipped due to unknown archive format')
+		if atype == 'zip':
+			members = iter_zip(fileobj)
+		elif atype == '7z':
+			members = iter_7z(fileobj)
+		elif atype == 'tar':
+			members = iter_tar(fileobj)
+		else:
+			members = iter_compressed(fileobj, name)
+		return closing_iter(members, fileobj), None
+	except Exception as e:
+		return None, e
+
+def closing_iter(members:Iterator[ArchiveMember], fileobj) -> Iterator[ArchiveMember]:
+	try:
+		yield from members
+	finally:
+		fileobj.close()
+
+async def read_member(member:ArchiveMember, limits:ArchiveLimits, chunk_size:int = ARCHIVE_CHUNK_SIZE):
+	"""Async generator yielding (data, err) tuples of a member's contents, within the limits.
+	Yields an error when the size limit is reached"""
+	try:
+		with member.open() as f:
+			while True:
+				size = limits.take(chunk_size)
+				if size == 0:
+					yield None, ArchiveSkipped('Skipped due to archive size limit')
+					return
+				data = f.read(size)
+				# unused part of the reservation goes back
+				limits.remaining += size - len(data)
+				if not data:
+					return
+				yield data, None
+	except Exception as e:
+		yield None, e
+
+async def read_member_all(member:ArchiveMember, limits:ArchiveLimits) -> Tuple[bytes, Exception]:
+	"""Reads the whole member into memory, within the limits"""
+	buffer = bytearray()
+	async for data, err in read_member(member, limits):
+		if err is not None:
+			return None, err
+		buffer += data
+	return bytes(buffer), None
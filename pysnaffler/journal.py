@@ -0,0 +1,152 @@
+import time
+import sqlite3
+from typing import List, Set
+
+# journal rows are written in batches of this size...
+JOURNAL_BATCH_SIZE = 1000
+# ...or after this many seconds, whichever comes first
+JOURNAL_FLUSH_INTERVAL = 5
+
+def journal_key(unc_path:str) -> str:
+	"""Path of an object inside the host, lowercased, eg. '\\\\srv\\C$\\Users' -> 'c$\\users'.
+	NFS paths ('srv//export/dir') are normalized the same way"""
+	parts = [x for x in unc_path.replace('/', '\\').split('\\') if x != '']
+	return '\\'.join(parts[1:]).lower()
+
+class DirNode:
+	__slots__ = ('key', 'parent', 'pending', 'closed', 'dirty')
+	def __init__(self, key:str, parent:'DirNode'):
+		self.key = key
+		self.parent = parent
+		self.pending = 0 # files and subdirectories not processed yet
+		self.closed = False # enumeration left the directory
+		self.dirty = False # something failed under the directory, it can't be skipped next time
+
+class HostProgress:
+	"""Scan progress of a single host.
+	The enumeration is depth-first, so a directory is left once an object outside of it shows up.
+	A directory is done when it was left and every file queued from it and all of its
+	subdirectories are done. Done directories and processed files are written to the journal,
+	a resumed scan doesn't enter the first and skips the latter."""
+	def __init__(self, journal:'SnafflerJournal', target:str, donedirs:Set[str], donefiles:Set[str]):
+		self.journal = journal
+		self.target = target
+		self.donedirs = donedirs
+		self.donefiles = donefiles
+		self.stack:List[DirNode] = []
+		self.failed = False # enumeration errors or failed files, the host needs to be revisited
+
+	def is_dir_done(self, key:str) -> bool:
+		return key in self.donedirs
+
+	def is_file_done(self, key:str) -> bool:
+		return key in self.donefiles
+
+	def enter(self, key:str, otype:str) -> DirNode:
+		"""Registers an enumerated object, returns the node of the directory it belongs to"""
+		while len(self.stack) > 0 and key.startswith(self.stack[-1].key + '\\') is False:
+			self.__close(self.stack.pop())
+		if len(self.stack) == 0:
+			# share (or NFS export) root
+			self.stack.append(DirNode(key.split('\\', 1)[0], None))
+		parent = self.stack[-1]
+		if otype == 'dir':
+			parent.pending += 1
+			self.stack.append(DirNode(key, parent))
+		return parent
+
+	def file_queued(self, node:DirNode):
+		node.pending += 1
+
+	def file_done(self, node:DirNode, key:str, failed:bool = False):
+		"""A queued file got processed. Failed files are not journaled and their directory is not marked done,
+		so a resumed scan processes them again"""
+		if failed is True:
+			self.failed = True
+			node.dirty = True
+		else:
+			self.journal.add(self.target, 'file', key)
+		node.pending -= 1
+		self.__check(node)
+
+	def error(self):
+		"""Enumeration error, none of the directories being enumerated can be marked done"""
+		self.failed = True
+		for node in self.stack:
+			node.dirty = True
+
+	def finish(self):
+		"""Enumeration of the host finished"""
+		while len(self.stack) > 0:
+			self.__close(self.stack.pop())
+
+	def __close(self, node:DirNode):
+		node.closed = True
+		self.__check(node)
+
+	def __check(self, node:DirNode):
+		while node is not None and node.closed is True and node.pending == 0:
+			if node.dirty is False:
+				self.journal.add(self.target, 'dir', node.key)
+			parent = node.parent
+			if parent is not None:
+				parent.dirty = parent.dirty or node.dirty
+				parent.pending -= 1
+			node = parent
+
+class SnafflerJournal:
+	"""On-disk journal of the scan progress, backed by SQLite.
+	Records finished hosts, fully processed shares/directories and processed files per host.
+	Writes are buffered and committed in batches."""
+	def __init__(self, path:str, resume:bool = False, batch_size:int = JOURNAL_BATCH_SIZE, flush_interval:float = JOURNAL_FLUSH_INTERVAL):
+		self.path = path
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.buffer = []
+		self.last_flush = time.monotonic()
+		self.db = sqlite3.connect(path)
+		self.db.execute('CREATE TABLE IF NOT EXISTS hosts (target TEXT PRIMARY KEY)')
+		self.db.execute('CREATE TABLE IF NOT EXISTS done (target TEXT, kind TEXT, path TEXT, PRIMARY KEY (target, kind, path))')
+		if resume is False:
+			self.db.execute('DELETE FROM hosts')
+			self.db.execute('DELETE FROM done')
+		self.db.commit()
+		self.donehosts = set([row[0] for row in self.db.execute('SELECT target FROM hosts')])
+
+	def is_host_done(self, target:str) -> bool:
+		return str(target) in self.donehosts
+
+	def open_host(self, target:str) -> HostProgress:
+		"""Loads the progress of a host from a previous run"""
+		donedirs = set()
+		donefiles = set()
+		for kind, path in self.db.execute('SELECT kind, path FROM done WHERE target = ?', (str(target),)):
+			if kind == 'dir':
+				donedirs.add(path)
+			else:
+				donefiles.add(path)
+		return HostProgress(self, str(target), donedirs, donefiles)
+
+	def host_done(self, target:str):
+		self.donehosts.add(str(target))
+		self.add(target, 'host', None)
+
+	def add(self, target:str, kind:str, path:str):
+		self.buffer.append((str(target), kind, path))
+		if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+			self.flush()
+
+	def flush(self):
+		self.last_flush = time.monotonic()
+		if len(self.buffer) == 0:
+			return
+		hosts = [(row[0],) for row in self.buffer if row[1] == 'host']
+		rows = [row for row in self.buffer if row[1] != 'host']
+		self.buffer = []
+		self.db.executemany('INSERT OR IGNORE INTO done (target, kind, path) VALUES (?, ?, ?)', rows)
+		self.db.executemany('INSERT OR IGNORE INTO hosts (target) VALUES (?)', hosts)
+		self.db.commit()
+
+	def close(self):
+		self.flush()
+		self.db.close()
@@ -0,0 +1,63 @@
+import asyncio
+import functools
+from typing import List, Tuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pysnaffler.ruleset import SnafflerRuleSet
+
+# copy of the ruleset in a worker process, set once by the pool initializer
+worker_ruleset:SnafflerRuleSet = None
+
+def init_worker(pickled_ruleset:bytes, profile:bool = False):
+	global worker_ruleset
+	worker_ruleset = SnafflerRuleSet.unpickle(pickled_ruleset)
+	if profile is True:
+		worker_ruleset.enable_profiling()
+
+def take_profile():
+	"""Returns the rule profile collected by the worker since the last call, None if not profiling"""
+	if worker_ruleset.profiler is None:
+		return None
+	return worker_ruleset.profiler.take()
+
+def scan_in_worker(*args):
+	"""Returns the results of scan_contents and the rule profile of the scan"""
+	res = []
+	for name, matches, err, elapsed in worker_ruleset.scan_contents(*args):
+		if err is not None:
+			# not all exceptions survive the trip back to the parent
+			err = Exception(str(err))
+		res.append((name, matches, err, elapsed))
+	return res, take_profile()
+
+class SnafflerMatchPool:
+	"""Runs the contents matching outside of the event loop.
+	The process backend ships the ruleset to every worker once, at startup, afterwards only
+	rule names, file paths (or in-memory data) and the results travel between the processes.
+	The thread backend shares the ruleset, it only helps if the matching releases the GIL."""
+	def __init__(self, ruleset:SnafflerRuleSet, workers:int = None, backend:str = 'process'):
+		self.ruleset = ruleset
+		self.backend = backend
+		if backend == 'process':
+			self.executor = ProcessPoolExecutor(workers, initializer = init_worker, initargs = (ruleset.pickle(), ruleset.profiler is not None))
+		elif backend == 'thread':
+			self.executor = ThreadPoolExecutor(workers)
+		else:
+			raise ValueError('Unknown match backend %s' % backend)
+
+	async def scan_contents(self, rulenames:List[str], filepath:str = None, data:bytes = None, chars_before_match:int = 0, chars_after_match:int = 0, first_match:bool = False, max_scan_bytes:int = 0) -> List[Tuple[str, str, Exception, float]]:
+		"""Same as SnafflerRuleSet.scan_contents, but awaitable"""
+		args = (rulenames, filepath, data, chars_before_match, chars_after_match, first_match, max_scan_bytes)
+		try:
+			loop = asyncio.get_running_loop()
+			if self.backend == 'process':
+				res, profile = await loop.run_in_executor(self.executor, scan_in_worker, *args)
+				if profile is not None and self.ruleset.profiler is not None:
+					self.ruleset.profiler.merge(profile)
+				return res
+			return await loop.run_in_executor(self.executor, functools.partial(self.ruleset.scan_contents, *args))
+		except Exception as e:
+			# eg. a worker process died
+			return [(name, False, e, 0.0) for name in rulenames]
+
+	def close(self):
+		self.executor.shutdown(wait = True, cancel_futures = True)
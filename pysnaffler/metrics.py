@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import asyncio
+import bisect
+from typing import Dict, List, Tuple
+from pysnaffler.utils import sizeof_fmt
+
+# upper bounds (seconds) of the latency histogram buckets, the last bucket is unbounded
+LATENCY_BUCKETS = [0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60]
+# rule evaluation is measured per scope
+RULE_SCOPES = ['share', 'dir', 'file', 'contents']
+# number of rules and hosts listed in the summary
+SUMMARY_TOP = 10
+
+class Histogram:
+	"""Cumulative latency histogram, Prometheus style"""
+	__slots__ = ('buckets', 'counts', 'count', 'sum')
+	def __init__(self, buckets:List[float] = LATENCY_BUCKETS):
+		self.buckets = buckets
+		self.counts = [0] * (len(buckets) + 1)
+		self.count = 0
+		self.sum = 0.0
+
+	def observe(self, value:float):
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.count += 1
+		self.sum += value
+
+	def to_dict(self):
+		cumulative = []
+		total = 0
+		for bound, count in zip(self.buckets + ['+Inf'], self.counts):
+			total += count
+			cumulative.append((str(bound), total))
+		return {
+			'count' : self.count,
+			'sum' : self.sum,
+			'buckets' : dict(cumulative),
+		}
+
+class HostMetrics:
+	__slots__ = ('started', 'finished', 'objects', 'files', 'bytes')
+	def __init__(self):
+		self.started = time.monotonic()
+		self.finished = None
+		self.objects = 0 # enumerated shares, directories and files
+		self.files = 0 # files processed (downloaded or streamed)
+		self.bytes = 0 # bytes read from the host
+
+	def elapsed(self) -> float:
+		end = self.finished if self.finished is not None else time.monotonic()
+		return max(end - self.started, 1e-9)
+
+class SnafflerMetrics:
+	"""Counters and timings of every stage of the scan.
+	Enumeration per host, rule evaluation time per scope, hits and matching time per rule,
+	download volume and latency, and the depth of the queues between the stages.
+	Only plain counters are updated on the hot paths, rates are computed when a snapshot is taken."""
+	def __init__(self):
+		self.started = time.monotonic()
+		self.hosts:Dict[str, HostMetrics] = {}
+		self.scope_time = {scope : 0.0 for scope in RULE_SCOPES}
+		self.scope_calls = {scope : 0 for scope in RULE_SCOPES}
+		self.rule_hits:Dict[str, int] = {}
+		self.rule_time:Dict[str, float] = {}
+		self.download_bytes = 0
+		self.download_latency = Histogram() # whole file downloads to disk
+		self.read_latency = Histogram() # chunks of streamed files
+		self.queues:Dict[Tuple[str, str], asyncio.Queue] = {}
+
+	def host_started(self, target:str):
+		self.hosts[str(target)] = HostMetrics()
+
+	def host_finished(self, target:str):
+		host = self.hosts.get(str(target))
+		if host is not None:
+			host.finished = time.monotonic()
+
+	def get_host(self, target:str) -> HostMetrics:
+		host = self.hosts.get(str(target))
+		if host is None:
+			host = HostMetrics()
+			self.hosts[str(target)] = host
+		return host
+
+	def add_queue(self, kind:str, target:str, queue:asyncio.Queue):
+		self.queues[(kind, str(target))] = queue
+
+	def remove_queue(self, kind:str, target:str):
+		self.queues.pop((kind, str(target)), None)
+
+	def rule_scope(self, scope:str, elapsed:float):
+		self.scope_time[scope] += elapsed
+		self.scope_calls[scope] += 1
+
+	def rule_elapsed(self, rulename:str, elapsed:float):
+		self.rule_time[rulename] = self.rule_time.get(rulename, 0.0) + elapsed
+
+	def contents_matched(self, timings:List[Tuple[str, float]]):
+		"""A file's contents were matched, timings are (rule name, seconds) of the contents rules"""
+		for rulename, elapsed in timings:
+			self.rule_elapsed(rulename, elapsed)
+			self.scope_time['contents'] += elapsed
+		self.scope_calls['contents'] += 1
+
+	def rule_hit(self, rulename:str):
+		self.rule_hits[rulename] = self.rule_hits.get(rulename, 0) + 1
+
+	def downloaded(self, target:str, size:int, elapsed:float = None, streamed:bool = False):
+		"""Bytes read from a host, elapsed is the latency of the download or of the chunk read"""
+		self.download_bytes += size
+		self.get_host(target).bytes += size
+		if elapsed is None:
+			return
+		if streamed is True:
+			self.read_latency.observe(elapsed)
+		else:
+			self.download_latency.observe(elapsed)
+
+	def queue_depths(self) -> Dict[str, int]:
+		"""Total number of items waiting in each kind of queue"""
+		depths = {}
+		for (kind, _), queue in list(self.queues.items()):
+			depths[kind] = depths.get(kind, 0) + queue.qsize()
+		return depths
+
+	def snapshot(self) -> dict:
+		elapsed = max(time.monotonic() - self.started, 1e-9)
+		hosts = {}
+		for target, host in list(self.hosts.items()):
+			hosts[target] = {
+				'objects' : host.objects,
+				'objects_per_sec' : host.objects / host.elapsed(),
+				'files' : host.files,
+				'bytes' : host.bytes,
+				'elapsed' : host.elapsed(),
+				'finished' : host.finished is not None,
+			}
+		rules = {}
+		for name in set(self.rule_hits) | set(self.rule_time):
+			rules[name] = {
+				'hits' : self.rule_hits.get(name, 0),
+				'time' : self.rule_time.get(name, 0.0),
+			}
+		return {
+			'elapsed' : elapsed,
+			'hosts' : hosts,
+			'objects' : sum(x.objects for x in self.hosts.values()),
+			'files' : sum(x.files for x in self.hosts.values()),
+			'scopes' : {scope : {'calls' : self.scope_calls[scope], 'time' : self.scope_time[scope]} for scope in RULE_SCOPES},
+			'rules' : rules,
+			'download_bytes' : self.download_bytes,
+			'download_bytes_per_sec' : self.download_bytes / elapsed,
+			'download_latency' : self.download_latency.to_dict(),
+			'read_latency' : self.read_latency.to_dict(),
+			'queues' : self.queue_depths(),
+		}
+
+	def to_prometheus(self) -> str:
+		"""Prometheus text exposition format, eg. for the node exporter's textfile collector"""
+		def esc(value):
+			return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+		snap = self.snapshot()
+		lines = []
+		def metric(name:str, mtype:str, values:List[Tuple[str, float]]):
+			lines.append('# TYPE pysnaffler_%s %s' % (name, mtype))
+			for labels, value in values:
+				lines.append('pysnaffler_%s%s %s' % (name, labels, value))
+
+		metric('host_objects_total', 'counter', [('{host="%s"}' % esc(t), h['objects']) for t, h in snap['hosts'].items()])
+		metric('host_files_total', 'counter', [('{host="%s"}' % esc(t), h['files']) for t, h in snap['hosts'].items()])
+		metric('host_bytes_total', 'counter', [('{host="%s"}' % esc(t), h['bytes']) for t, h in snap['hosts'].items()])
+		metric('rule_scope_seconds_total', 'counter', [('{scope="%s"}' % s, v['time']) for s, v in snap['scopes'].items()])
+		metric('rule_scope_calls_total', 'counter', [('{scope="%s"}' % s, v['calls']) for s, v in snap['scopes'].items()])
+		metric('rule_hits_total', 'counter', [('{rule="%s"}' % esc(r), v['hits']) for r, v in snap['rules'].items()])
+		metric('rule_seconds_total', 'counter', [('{rule="%s"}' % esc(r), v['time']) for r, v in snap['rules'].items()])
+		metric('download_bytes_total', 'counter', [('', snap['download_bytes'])])
+		for name in ['download_latency', 'read_latency']:
+			hist = snap[name]
+			values = [('{le="%s"}' % bound, count) for bound, count in hist['buckets'].items()]
+			lines.append('# TYPE pysnaffler_%s_seconds histogram' % name)
+			for labels, value in values:
+				lines.append('pysnaffler_%s_seconds_bucket%s %s' % (name, labels, value))
+			lines.append('pysnaffler_%s_seconds_sum %s' % (name, hist['sum']))
+			lines.append('pysnaffler_%s_seconds_count %s' % (name, hist['count']))
+		metric('queue_depth', 'gauge', [('{queue="%s"}' % q, v) for q, v in snap['queues'].items()])
+		return '\n'.join(lines) + '\n'
+
+	def write_snapshot(self, path:str):
+		"""Writes the snapshot as JSON, or in Prometheus text format if the file name ends with .prom.
+		The file is replaced atomically, readers never see a partial snapshot"""
+		if path.endswith('.prom') is True:
+			data = self.to_prometheus()
+		else:
+			data = json.dumps(self.snapshot(), indent = 4)
+		temp = path + '.tmp'
+		with open(temp, 'w') as f:
+			f.write(data)
+		os.replace(temp, path)
+
+	def stats_line(self) -> str:
+		elapsed = max(time.monotonic() - self.started, 1e-9)
+		objects = sum(x.objects for x in self.hosts.values())
+		files = sum(x.files for x in self.hosts.values())
+		active = len([x for x in self.hosts.values() if x.finished is None])
+		queues = ' '.join('%s=%s' % (k, v) for k, v in sorted(self.queue_depths().items()))
+		return '[stats] hosts %s active | objects %s (%.1f/s) | files %s (%.1f/s) | read %s (%s/s) | rules %s | queues %s' % (
+			active,
+			objects, objects / elapsed,
+			files, files / elapsed,
+			sizeof_fmt(self.download_bytes), sizeof_fmt(self.download_bytes / elapsed),
+			' '.join('%s=%.2fs' % (scope, self.scope_time[scope]) for scope in RULE_SCOPES),
+			queues,
+		)
+
+	async def report_periodically(self, interval:float, path:str = None, show:bool = True):
+		"""Prints the stats line and/or writes the snapshot file every interval seconds"""
+		while True:
+			await asyncio.sleep(interval)
+			try:
+				if show is True:
+					print(self.stats_line())
+				if path is not None:
+					self.write_snapshot(path)
+			except Exception as e:
+				print('Failed to report metrics: %s' % e)
+
+	def print_summary(self):
+		"""Slowest rules and slowest hosts, to find what holds the scan back"""
+		print('Rule evaluation time: %s' % ', '.join('%s %.2fs (%s calls)' % (scope, self.scope_time[scope], self.scope_calls[scope]) for scope in RULE_SCOPES))
+		rules = sorted(set(self.rule_hits) | set(self.rule_time), key = lambda x: self.rule_time.get(x, 0.0), reverse = True)[:SUMMARY_TOP]
+		for name in rules:
+			print('    %s: %.2fs %s hits' % (name, self.rule_time.get(name, 0.0), self.rule_hits.get(name, 0)))
+		hosts = sorted(self.hosts.items(), key = lambda x: x[1].elapsed(), reverse = True)[:SUMMARY_TOP]
+		if len(hosts) > 0:
+			print('Slowest hosts:')
+		for target, host in hosts:
+			print('    %s: %.1fs %s objects (%.1f/s) %s files %s' % (target, host.elapsed(), host.objects, host.objects / host.elapsed(), host.files, sizeof_fmt(host.bytes)))
@@ -0,0 +1,216 @@
+import os
+import json
+import asyncio
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict
+from tqdm import tqdm
+from asysocks.unicomm.common.scanner.common import ScannerResult, ScannerResultType
+from asysocks.unicomm.common.scanner.scanner import UniScanner
+
+try:
+	import pyarrow
+	import pyarrow.parquet
+except ImportError:
+	pyarrow = None
+
+# buffered rows are written out when the buffer reaches this size...
+OUTPUT_BATCH_SIZE = 1000
+# ...or after this many seconds
+OUTPUT_FLUSH_INTERVAL = 4
+# rows per parquet row group, small row groups make the file slow to read
+PARQUET_BATCH_SIZE = 65536
+# columns stored as integers in columnar output, everything else is a string
+INTEGER_COLUMNS = ['size']
+
+OUTPUT_FORMATS = ['tsv', 'jsonl', 'parquet']
+
+class OutputWriter(ABC):
+	"""Buffers result rows in memory and writes them out in batches"""
+	extension = ''
+	def __init__(self, path:str, batch_size:int = OUTPUT_BATCH_SIZE):
+		self.path = path
+		self.batch_size = batch_size
+		self.buffer = []
+		self.rows = 0
+
+	@abstractmethod
+	def format(self, result:ScannerResult):
+		pass
+
+	def write(self, result:ScannerResult):
+		self.buffer.append(self.format(result))
+		if len(self.buffer) >= self.batch_size:
+			self.flush()
+
+	@abstractmethod
+	def flush(self):
+		pass
+
+	def close(self):
+		self.flush()
+
+class TextWriter(OutputWriter):
+	def __init__(self, path:str, batch_size:int = OUTPUT_BATCH_SIZE):
+		OutputWriter.__init__(self, path, batch_size)
+		self.fhandle = open(path, 'w', newline = '')
+
+	def flush(self):
+		if len(self.buffer) == 0:
+			return
+		self.rows += len(self.buffer)
+		self.fhandle.write(''.join(self.buffer))
+		self.buffer = []
+		self.fhandle.flush()
+
+	def close(self):
+		self.flush()
+		self.fhandle.close()
+
+class TSVWriter(TextWriter):
+	"""Same tab separated lines UniScanner writes"""
+	extension = 'tsv'
+	def format(self, result:ScannerResult):
+		return result.to_line() + '\r\n'
+
+class JSONLWriter(TextWriter):
+	"""One JSON object per line"""
+	extension = 'jsonl'
+	def format(self, result:ScannerResult):
+		if result.type == ScannerResultType.ERROR:
+			# ScannerError has no to_dict, its data is the repr of the exception
+			return json.dumps({'resid' : result.resid, 'error' : str(result.data)}) + '\n'
+		return json.dumps(result.to_dict()) + '\n'
+
+class ParquetWriter(OutputWriter):
+	"""Columnar output, one row group per batch. Needs pyarrow.
+	The columns are the target and the fields listed by the record's get_header,
+	the schema is fixed by the first record written"""
+	extension = 'parquet'
+	def __init__(self, path:str, batch_size:int = PARQUET_BATCH_SIZE):
+		if pyarrow is None:
+			raise Exception('Parquet output needs the pyarrow package')
+		OutputWriter.__init__(self, path, batch_size)
+		self.columns = None
+		self.schema = None
+		self.writer = None
+
+	def format(self, result:ScannerResult):
+		if self.columns is None:
+			self.columns = ['target'] + result.data.get_header()
+			self.schema = pyarrow.schema([(name, pyarrow.int64() if name in INTEGER_COLUMNS else pyarrow.string()) for name in self.columns])
+		row = result.data.to_dict()
+		row['target'] = result.resid
+		return row
+
+	def __column(self, name:str):
+		if name in INTEGER_COLUMNS:
+			return [x.get(name) if isinstance(x.get(name), int) else None for x in self.buffer]
+		return [None if x.get(name) is None else str(x.get(name)) for x in self.buffer]
+
+	def flush(self):
+		if len(self.buffer) == 0:
+			return
+		table = pyarrow.Table.from_arrays([self.__column(name) for name in self.columns], schema = self.schema)
+		if self.writer is None:
+			self.writer = pyarrow.parquet.ParquetWriter(self.path, self.schema)
+		self.rows += len(self.buffer)
+		self.buffer = []
+		self.writer.write_table(table)
+
+	def close(self):
+		self.flush()
+		if self.writer is not None:
+			self.writer.close()
+
+WRITERS = {
+	'tsv' : TSVWriter,
+	'jsonl' : JSONLWriter,
+	'parquet' : ParquetWriter,
+}
+
+class SnafflerOutput:
+	"""Writes the results of a scan to files in out_dir, one file per result type, in the given format.
+	Errors are written as JSONL for JSONL output and as TSV otherwise.
+	Parquet files are only written at row group boundaries, the flush interval doesn't apply to them"""
+	def __init__(self, out_dir:str, name:str, scantime:str, output_format:str = 'tsv', flush_interval:float = OUTPUT_FLUSH_INTERVAL, include_errors:bool = False):
+		if output_format not in WRITERS:
+			raise Exception('Unknown output format %s' % output_format)
+		self.out_dir = Path.cwd() if out_dir is None else Path(out_dir)
+		self.name = name
+		self.scantime = scantime
+		self.output_format = output_format
+		self.flush_interval = flush_interval
+		self.include_errors = include_errors
+		self.writers:Dict[str, OutputWriter] = {}
+		self.out_dir.mkdir(parents = True, exist_ok = True)
+
+	def __get_writer(self, name:str, output_format:str) -> OutputWriter:
+		if name not in self.writers:
+			writertype = WRITERS[output_format]
+			path = os.path.join(self.out_dir.absolute(), '%s_%s.%s' % (name, self.scantime, writertype.extension))
+			self.writers[name] = writertype(path)
+		return self.writers[name]
+
+	def write(self, result:ScannerResult):
+		if result.type == ScannerResultType.DATA:
+			filedata = result.get_fdata()
+			if filedata is not None:
+				with open(result.get_fname(), 'wb') as f:
+					f.write(filedata)
+				return
+			self.__get_writer(result.get_name(), self.output_format).write(result)
+		elif result.type == ScannerResultType.ERROR and self.include_errors is True:
+			errorformat = 'jsonl' if self.output_format == 'jsonl' else 'tsv'
+			self.__get_writer('%s_error' % self.name, errorformat).write(result)
+
+	def flush(self):
+		for writer in self.writers.values():
+			if isinstance(writer, ParquetWriter):
+				continue
+			writer.flush()
+
+	async def flush_periodically(self):
+		while True:
+			await asyncio.sleep(self.flush_interval)
+			self.flush()
+
+	def close(self):
+		for writer in self.writers.values():
+			try:
+				writer.close()
+			except Exception as e:
+				print('Failed to close output file %s: %s' % (writer.path, e))
+
+async def scan_and_write(scanner:UniScanner, output:SnafflerOutput, progress:bool = True):
+	"""Replacement of UniScanner.scan_and_process, writes the results through the buffered output writers"""
+	flush_task = asyncio.create_task(output.flush_periodically())
+	try:
+		pbar = {}
+		if progress is True:
+			total = 0
+			for generator in scanner.target_generators:
+				total += generator.get_total()
+			pbar['targets'] = tqdm(desc='Targets     ', unit='', position=0, total=total)
+			pbar['results'] = tqdm(desc='Results     ', unit='', position=1)
+			pbar['errors']  = tqdm(desc='Errors      ', unit='', position=2)
+
+		async for result in scanner.scan():
+			if len(pbar) > 0:
+				if result.type == ScannerResultType.ERROR:
+					pbar['errors'].update()
+				elif result.type == ScannerResultType.PROGRESS:
+					pbar['targets'].update()
+				elif result.type == ScannerResultType.DATA:
+					pbar['results'].update()
+				elif result.type == ScannerResultType.FINISHED:
+					for k in pbar:
+						pbar[k].refresh()
+			output.write(result)
+
+	except Exception as e:
+		print('SCANNER CRITICAL ERROR %s' % str(e))
+	finally:
+		flush_task.cancel()
+		await scanner.stop()
+		output.close()
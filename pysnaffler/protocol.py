@@ -4,6 +4,10 @@ from aiosmb.commons.interfaces.machine import SMBMachine
 from aiosmb.commons.interfaces.file import SMBFile
 
 from anfs.protocol.nfs3.client import NFSAccessError, NFSFileEntry
+from anfs.protocol.rpc.messages import AUTH_SYS
+
+# read size used when the protocol doesn't tell us the maximum
+DEFAULT_READ_SIZE = 1024*1024
 
 class ProtocolClient(ABC):
 	@abstractmethod
@@ -18,10 +22,29 @@ class ProtocolClient(ABC):
 	async def donwload_file(self, file, localpath, max_size):
 		pass
 
+	@abstractmethod
+	async def read_file_chunked(self, file, max_size):
+		"""Reads at most max_size bytes of the file without touching the local filesystem.
+		Yields (data, err) tuples"""
+		yield None, None
+
+	async def read_file(self, file, max_size):
+		"""Reads at most max_size bytes of the file into memory. Returns (data, err)"""
+		buffer = bytearray()
+		async for data, err in self.read_file_chunked(file, max_size):
+			if err is not None:
+				return None, err
+			buffer += data
+		return bytes(buffer), None
+
 	@abstractmethod
 	async def enum_files_with_filter(self, filter):
 		pass
 
+	async def close(self):
+		"""Releases the connections, called after all files have been processed"""
+		pass
+
 class SMBProtocolClient(ProtocolClient):
 	
 	def __init__(self, factory, target):
@@ -43,6 +66,30 @@ class SMBProtocolClient(ProtocolClient):
 	async def donwload_file(self, file: SMBFile, localpath, max_size):
 		return await file.download(self.connection, localpath)
 
+	async def read_file_chunked(self, file: SMBFile, max_size):
+		# if treeid is already present, we won't be closing it after the read
+		closetree = True if file.tree_id is None else False
+		try:
+			_, err = await file.open(self.connection, 'r')
+			if err is not None:
+				yield None, err
+				return
+			chunksize = self.connection.MaxReadSize
+			remaining = min(file.size, max_size)
+			while remaining > 0:
+				data, err = await file.read(min(chunksize, remaining))
+				if err is not None:
+					yield None, err
+					return
+				if not data:
+					break
+				remaining -= len(data)
+				yield data, None
+		finally:
+			await file.close()
+			if file.tree_id is not None and closetree is True:
+				await self.connection.tree_disconnect(file.tree_id)
+
 	
 	async def enum_files_with_filter(self, filter):
 		async for obj, otype, err in self.machine.enum_files_with_filter(filter):
@@ -55,6 +102,7 @@ class NFSProtocolClient(ProtocolClient):
 		self.target = target
 		self.connection = None
 		self.client = None
+		self.clients = []
 		self.newfactory = None
 
 	
@@ -62,8 +110,28 @@ class NFSProtocolClient(ProtocolClient):
 		self.newfactory = self.factory.create_factory_newtarget(target)
 
 	
+	def get_client(self, file):
+		# files are processed after enumeration moved on, they have to use the client of their own mountpoint
+		return getattr(file, 'nfs_client', self.client)
+
 	async def donwload_file(self, file, localpath, max_size):
-		return await self.client.download_file(file.nfs_file.handle, localpath, max_size = max_size, uid = file.nfs_file.uid, gid = file.nfs_file.gid)
+		return await self.get_client(file).download_file(file.nfs_file.handle, localpath, max_size = max_size, uid = file.nfs_file.uid, gid = file.nfs_file.gid)
+
+	async def read_file_chunked(self, file, max_size):
+		client = self.get_client(file)
+		auth = AUTH_SYS(uid = file.nfs_file.uid, gid = file.nfs_file.gid)
+		offset = 0
+		remaining = min(file.size, max_size)
+		while remaining > 0:
+			data, err = await client.read(file.nfs_file.handle, offset, min(DEFAULT_READ_SIZE, remaining), auth = auth)
+			if err is not None:
+				yield None, err
+				return
+			if not data:
+				break
+			offset += len(data)
+			remaining -= len(data)
+			yield data, None
 
 	@staticmethod
 	def filter_wrapper(filter, target, mount_path):
@@ -94,16 +162,29 @@ class NFSProtocolClient(ProtocolClient):
 
 				filter_cb = NFSProtocolClient.filter_wrapper(filter, self.target, mountpoint)
 
-				async with self.newfactory.get_client(mhandle) as nfs:
-					self.client = nfs
-					async for epath, etype, entry, err in nfs.enumall(0, depth=30, filter_cb = filter_cb):
-						if err is not None and not isinstance(err, NFSAccessError):
-							yield None, None, None, err
-						elif isinstance(entry, NFSFileEntry):
-							yield entry.to_smbfile(self.target, mountpoint, epath), etype, err
+				# the client is kept open until close(), files of this mountpoint might still be waiting to be read
+				nfs = self.newfactory.get_client(mhandle)
+				_, err = await nfs.connect()
+				if err is not None:
+					yield None, None, err
+					continue
+				self.client = nfs
+				self.clients.append(nfs)
+				async for epath, etype, entry, err in nfs.enumall(0, depth=30, filter_cb = filter_cb):
+					if err is not None and not isinstance(err, NFSAccessError):
+						yield None, None, err
+					elif isinstance(entry, NFSFileEntry):
+						smb_obj = entry.to_smbfile(self.target, mountpoint, epath)
+						smb_obj.nfs_client = nfs
+						yield smb_obj, etype, err
 
 	async def __aenter__(self):
 		return self
 	
 	async def __aexit__(self, exc_type, exc, tb):
-		await self.client.disconnect()
\ No newline at end of file
+		await self.close()
+
+	async def close(self):
+		for client in self.clients:
+			await client.disconnect()
+		self.clients = []
@@ -1,7 +1,7 @@
-import codecs
 from pysnaffler.rules.rule import SnaffleRule
 from pysnaffler.rules.constants import EnumerationScope, MatchAction, MatchLoc, MatchListType, Triage
 from typing import List
+from pysnaffler.rules.contentscanner import SnafflerContentScanner, line_span
 
 class SnafflerContentsEnumerationRule(SnaffleRule):
 	def __init__(self, enumerationScope:EnumerationScope, ruleName:str, matchAction:MatchAction, relayTargets:List[str], description:str, matchLocation:MatchLoc, wordListType:MatchListType, matchLength:int, wordList:List[str], triage:Triage):
@@ -10,29 +10,28 @@ class SnafflerContentsEnumerationRule(SnaffleRule):
 	def match(self, data, chars_before = 0, chars_after = 0):
 		matches = []
 		for rex in self.wordList:
+			lineend = -1
 			for match in rex.finditer(data):
-				text = match.group(0)
+				start, end = match.start(), match.end()
+				if self.wordListType == MatchListType.Contains:
+					# Contains matches are reported with the whole line, once per line
+					if start < lineend:
+						continue
+					start, end = line_span(data, start, end)
+					lineend = end
+				text = data[start:end]
 				if chars_before > 0:
-					text = data[max(match.start() - chars_before, 0) : match.start()] + text
+					text = data[max(start - chars_before, 0) : start] + text
 				if chars_after > 0:
-					text += data[match.end() : min(match.end() + chars_after, len(data))]
+					text += data[end : min(end + chars_after, len(data))]
 				matches.append(text)
 		return '\r\n'.join(matches)
 
 	def open_and_match(self, filename, chars_before, chars_after):
-		try:
-			if self.matchLocation == MatchLoc.FileContentAsString:
-				with codecs.open(filename, 'r', 'latin-1') as f:
-					data = f.read()
-					return self.match(data, chars_before, chars_after), None
-			elif self.matchLocation == MatchLoc.FileContentAsBytes:
-				with open(filename, 'rb') as f:
-					data = f.read()
-					return self.match(data, chars_before, chars_after), None
-			else:
-				return False, Exception('ERROR: Unknown match location: %s' % self.matchLocation)
-		except Exception as e:
-			return False, e
+		scanner = SnafflerContentScanner([self], chars_before, chars_after)
+		scanner.scan_file(filename)
+		_, res, err = scanner.results()[0]
+		return res, err
 
 	def determine_action(self, data, **kwargs):
 		pass
\ No newline at end of file
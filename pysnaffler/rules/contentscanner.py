@@ -0,0 +1,473 @@
+import re
+import time
+import hashlib
+from typing import Dict, List, Tuple
+from pysnaffler.rules.constants import MatchAction, MatchLoc, MatchListType
+from pysnaffler.rules.rule import SnaffleRule
+from pysnaffler.rules.keys import KEY_SCAN_SIZE, detect_keys
+
+try:
+	import re._parser as sre_parse
+	from re._constants import LITERAL, SUBPATTERN
+except ImportError:
+	import sre_parse
+	from sre_constants import LITERAL, SUBPATTERN
+
+# the file is scanned in chunks of this size
+DEFAULT_CHUNK_SIZE = 1024*1024
+# patterns whose matches can be longer than this (eg. '.*') are treated as unbounded,
+# they are matched once all the data is in, see SnafflerContentScanner
+MAX_OVERLAP = 64*1024
+# extra characters kept on both sides of the scan window for lookarounds and \b
+CONTEXT_GUARD = 256
+# Contains matches are widened to the line they are on, at most this many characters on both sides
+MAX_LINE_CONTEXT = 64*1024
+# pattern name the private key detector is profiled under
+KEY_DETECTOR = '<key detector>'
+
+def max_match_length(rex:re.Pattern) -> int:
+	"""Returns the longest possible match of the pattern, capped at MAX_OVERLAP"""
+	try:
+		_, maxwidth = sre_parse.parse(rex.pattern, rex.flags).getwidth()
+	except Exception:
+		return MAX_OVERLAP
+	return min(maxwidth, MAX_OVERLAP)
+
+def longest_literal(items) -> str:
+	best = ''
+	current = ''
+	for op, av in items:
+		if op is LITERAL:
+			current += chr(av)
+			continue
+		best = max(best, current, key=len)
+		current = ''
+		if op is SUBPATTERN:
+			# groups are mandatory parts of the match, (group, add_flags, del_flags, pattern)
+			best = max(best, longest_literal(av[-1]), key=len)
+	return max(best, current, key=len)
+
+def required_literal(rex:re.Pattern):
+	"""Returns the longest lowercase ASCII literal that every match of the pattern contains, or None.
+	Used as a cheap prefilter: if the (lowercased) data doesn't contain it, the pattern can't match."""
+	try:
+		literal = longest_literal(sre_parse.parse(rex.pattern, rex.flags))
+	except Exception:
+		return None
+	if len(literal) < 3 or literal.isascii() is False:
+		# non-ASCII characters have case folding rules that lower() doesn't follow
+		return None
+	literal = literal.lower()
+	if isinstance(rex.pattern, bytes):
+		return literal.encode('ascii')
+	return literal
+
+def leading_literal(rex:re.Pattern) -> Tuple[object, int]:
+	"""Returns a lowercase ASCII literal every match of the pattern contains and the max number of
+	characters a match can start before it, or (None, 0). Only literals preceded by a bounded part of
+	the pattern qualify, eg. 'pass' of 'passw?o?r?d\\s*=.*' with 0, 'oauth' of '[_.]oauth\\s*=.*' with 1"""
+	try:
+		parsed = sre_parse.parse(rex.pattern, rex.flags)
+	except Exception:
+		return None, 0
+	items = list(parsed)
+	i = 0
+	while i < len(items):
+		j = i
+		while j < len(items) and items[j][0] is LITERAL:
+			j += 1
+		literal = ''.join(chr(av) for _, av in items[i:j])
+		if len(literal) >= 3 and literal.isascii() is True:
+			_, lead = sre_parse.SubPattern(parsed.state, items[:i]).getwidth()
+			if lead >= MAX_OVERLAP:
+				return None, 0
+			literal = literal.lower()
+			if isinstance(rex.pattern, bytes):
+				literal = literal.encode('ascii')
+			return literal, lead
+		i = j + 1
+	return None, 0
+
+def to_bytes_pattern(rex:re.Pattern) -> re.Pattern:
+	"""Compiles the bytes equivalent of a str pattern, used by FileContentAsBytes rules"""
+	if isinstance(rex.pattern, bytes):
+		return rex
+	return re.compile(rex.pattern.encode('latin-1'), flags=rex.flags & ~re.UNICODE)
+
+def line_span(data, start:int, end:int) -> Tuple[int, int]:
+	"""Returns the start and end of the line(s) around data[start:end], without the newlines.
+	The line is cut at MAX_LINE_CONTEXT characters on both sides"""
+	newline = b'\n' if isinstance(data, bytes) else '\n'
+	linestart = data.rfind(newline, max(start - MAX_LINE_CONTEXT, 0), start) + 1
+	if linestart == 0:
+		linestart = max(start - MAX_LINE_CONTEXT, 0)
+	lineend = data.find(newline, end, end + MAX_LINE_CONTEXT)
+	if lineend == -1:
+		lineend = min(end + MAX_LINE_CONTEXT, len(data))
+	return linestart, lineend
+
+class PatternState:
+	__slots__ = ('rex', 'overlap', 'before', 'maxwidth', 'literal', 'lead', 'line', 'pos', 'matches')
+	def __init__(self, rex:re.Pattern, maxwidth:int, overlap:int, before:int, literal, lead:Tuple[object, int] = (None, 0), line:bool = False):
+		self.rex = rex
+		self.maxwidth = maxwidth # None if the pattern has no upper bound
+		self.overlap = overlap
+		self.before = before # data needed before the start of a match
+		self.literal = literal
+		self.lead = lead # leading_literal of unbounded patterns
+		self.line = line # matches are widened to the whole line (Contains rules)
+		self.pos = 0 # absolute offset the next search starts from
+		self.matches = []
+
+class RuleState:
+	__slots__ = ('rule', 'patterns', 'asbytes', 'err', 'matched', 'detected', 'elapsed')
+	def __init__(self, rule:SnaffleRule, patterns:List[PatternState], asbytes:bool, err:Exception = None):
+		self.rule = rule
+		self.patterns = patterns
+		self.asbytes = asbytes
+		self.err = err
+		self.matched = False
+		self.detected = '' # matching digest of FileMD5 rules, keys found by CheckForKeys rules
+		self.elapsed = 0.0 # seconds spent matching the rule
+
+class SnafflerContentScanner:
+	"""Scans a file's contents for multiple contents rules in a single streaming pass.
+	Data is fed in arbitrary pieces and scanned in chunks of chunk_size, every chunk is
+	overlapped with the previous one by the longest possible match of each pattern
+	(plus the requested context), so matches spanning chunk boundaries are found exactly once.
+	Patterns without an upper bound on the match length are matched at the end, on all the data
+	from the first position a match can start, the results are the same as matching the whole file.
+	Every chunk is decoded once and shared by all rules, the latin-1 string view by
+	FileContentAsString rules, the raw bytes view by FileContentAsBytes rules.
+	Patterns are only run on a chunk if its lowercased view contains their required literal.
+	Matches of Contains rules are widened to the line they are on (up to MAX_LINE_CONTEXT on both sides),
+	a line is reported once however many matches it has.
+	FileMD5 rules are matched by the digests of the whole file, the digests are computed
+	while the data is fed (one hasher per algorithm, shared by the rules) and looked up at the end.
+	CheckForKeys rules run the private key detector on the first KEY_SCAN_SIZE bytes of the file.
+	With first_match a rule stops being evaluated after its first match, max_bytes limits
+	how much of the file is scanned (0 means no limit). Once done is True no more data is needed."""
+	def __init__(self, rules:List[SnaffleRule], chars_before:int = 0, chars_after:int = 0, chunk_size:int = DEFAULT_CHUNK_SIZE, first_match:bool = False, max_bytes:int = 0):
+		self.chars_before = chars_before
+		self.chars_after = chars_after
+		self.chunk_size = chunk_size
+		self.first_match = first_match
+		self.max_bytes = max_bytes
+		self.scanned = 0 # total bytes accepted by feed
+		self.buffer = bytearray()
+		self.offset = 0 # absolute offset of the first byte in the buffer
+		self.pending = 0 # bytes fed since the last scan
+		self.finished = False
+		self.hashers = {} # algorithm -> hashlib object
+		self.head = None # beginning of the file for the key detector, only kept if needed
+		self.states:List[RuleState] = []
+		for rule in rules:
+			self.states.append(self.__create_state(rule))
+
+	def __create_state(self, rule:SnaffleRule) -> RuleState:
+		if rule.matchAction == MatchAction.CheckForKeys:
+			self.head = bytearray()
+			return RuleState(rule, [], True)
+		if rule.matchLocation == MatchLoc.FileContentAsString:
+			asbytes = False
+		elif rule.matchLocation == MatchLoc.FileContentAsBytes:
+			asbytes = True
+		elif rule.matchLocation == MatchLoc.FileMD5:
+			for algorithm in rule.hashAlgorithms:
+				if algorithm not in self.hashers:
+					self.hashers[algorithm] = hashlib.new(algorithm)
+			return RuleState(rule, [], True)
+		else:
+			return RuleState(rule, [], False, Exception('ERROR: Unknown match location: %s' % rule.matchLocation))
+		patterns = []
+		# Contains words are matched on their own, the report has the line they are on
+		line = rule.wordListType == MatchListType.Contains
+		context = MAX_LINE_CONTEXT if line is True else 0
+		before = max(context + self.chars_before, CONTEXT_GUARD)
+		try:
+			for rex in rule.wordList:
+				if asbytes is True:
+					rex = to_bytes_pattern(rex)
+				maxwidth = max_match_length(rex)
+				overlap = maxwidth + context + self.chars_after + CONTEXT_GUARD
+				if maxwidth >= MAX_OVERLAP:
+					patterns.append(PatternState(rex, None, overlap, before, required_literal(rex), leading_literal(rex), line))
+					continue
+				patterns.append(PatternState(rex, maxwidth, overlap, before, required_literal(rex), line = line))
+		except Exception as e:
+			return RuleState(rule, [], asbytes, e)
+		return RuleState(rule, patterns, asbytes)
+
+	@property
+	def done(self) -> bool:
+		"""True if feeding more data can't change the results"""
+		if self.finished is True:
+			return True
+		if self.max_bytes > 0 and self.scanned >= self.max_bytes:
+			return True
+		for state in self.states:
+			if state.err is not None:
+				continue
+			if state.rule.matchAction == MatchAction.CheckForKeys:
+				if self.scanned < KEY_SCAN_SIZE:
+					return False
+				continue
+			if self.first_match is False or state.matched is False:
+				return False
+		return True
+
+	def feed(self, data:bytes):
+		"""Adds data to the scan buffer, scans the buffer if a full chunk is available.
+		Data over the max_bytes budget is ignored"""
+		if self.max_bytes > 0:
+			if self.scanned >= self.max_bytes:
+				return
+			data = data[:self.max_bytes - self.scanned]
+		self.scanned += len(data)
+		# large pieces are split so the chunk boundaries don't depend on how the data arrives
+		view = memoryview(data)
+		while len(view) > 0:
+			piece = view[:self.chunk_size - self.pending]
+			view = view[len(piece):]
+			for hasher in self.hashers.values():
+				hasher.update(piece)
+			if self.head is not None and len(self.head) < KEY_SCAN_SIZE:
+				self.head += piece[:KEY_SCAN_SIZE - len(self.head)]
+			self.buffer += piece
+			self.pending += len(piece)
+			if self.pending >= self.chunk_size:
+				self.__scan(False)
+
+	def finish(self):
+		"""Signals the end of the file, scans whatever is left in the buffer"""
+		if self.finished is True:
+			return
+		self.__scan(True)
+		self.__match_digests()
+		self.__detect_keys()
+		self.finished = True
+		self.buffer = bytearray()
+
+	def __detect_keys(self):
+		if self.head is None:
+			return
+		size = len(self.head)
+		start = time.perf_counter()
+		found = '\r\n'.join(detect_keys(bytes(self.head)))
+		elapsed = time.perf_counter() - start
+		self.head = None
+		for state in self.states:
+			if state.err is None and state.rule.matchAction == MatchAction.CheckForKeys:
+				state.detected = found
+				state.matched = found != ''
+				state.elapsed += elapsed
+				if state.rule.profiler is not None:
+					state.rule.profiler.record(state.rule.ruleName, KEY_DETECTOR, elapsed, size)
+
+	def __match_digests(self):
+		if len(self.hashers) == 0:
+			return
+		if self.max_bytes > 0 and self.scanned >= self.max_bytes:
+			# the file might have been cut by the scan budget, the digests are not the file's
+			return
+		digests = {}
+		for algorithm, hasher in self.hashers.items():
+			digests[algorithm] = hasher.hexdigest()
+		for state in self.states:
+			if state.err is not None or state.rule.matchLocation != MatchLoc.FileMD5 or state.rule.matchAction == MatchAction.CheckForKeys:
+				continue
+			for algorithm in state.rule.hashAlgorithms:
+				if state.rule.match_wordlist(digests[algorithm]) is True:
+					state.detected = digests[algorithm]
+					state.matched = True
+					break
+
+	def is_deferred(self, pattern:PatternState, final:bool) -> bool:
+		"""Unbounded patterns are matched once all the data is in, a match might extend to the end of it.
+		Until then only the position a match can start from is moved forward.
+		With first_match they are matched as the data comes, overlapping the chunks by MAX_OVERLAP"""
+		return pattern.maxwidth is None and final is False and self.first_match is False
+
+	def __scan(self, final:bool):
+		self.pending = 0
+		# views are created once per chunk, on first use, from the earliest position a pattern needs.
+		# deferred patterns holding on to older data don't need it until the end
+		views = {}
+		end = self.offset + len(self.buffer)
+		base = end
+		for state in self.states:
+			if state.err is not None or state.matched is True:
+				continue
+			for pattern in state.patterns:
+				if self.is_deferred(pattern, final) is False or pattern.lead[0] is not None:
+					base = min(base, pattern.pos - pattern.before)
+		base = max(base, self.offset)
+		for state in self.states:
+			if state.err is not None or state.matched is True or len(state.patterns) == 0:
+				continue
+			if state.asbytes not in views:
+				view = self.buffer if base == self.offset else self.buffer[base - self.offset:]
+				if state.asbytes is True:
+					data = bytes(view)
+				else:
+					data = view.decode('latin-1')
+				views[state.asbytes] = (data, data.lower())
+			data, lowered = views[state.asbytes]
+			start = time.perf_counter()
+			try:
+				for pattern in state.patterns:
+					if state.rule.profiler is not None:
+						self.__profile_pattern(state.rule, pattern, data, lowered, base, final)
+					else:
+						self.__scan_pattern(pattern, data, lowered, base, final)
+					if self.first_match is True and len(pattern.matches) > 0:
+						state.matched = True
+						break
+			except Exception as e:
+				state.err = e
+			state.elapsed += time.perf_counter() - start
+
+		# keeping enough data before the earliest resume position for the context
+		keep_from = end
+		for state in self.states:
+			if state.err is not None or state.matched is True:
+				continue
+			for pattern in state.patterns:
+				keep_from = min(keep_from, pattern.pos - pattern.before)
+		keep_from = max(keep_from, self.offset)
+		del self.buffer[:keep_from - self.offset]
+		self.offset = keep_from
+
+	def __profile_pattern(self, rule:SnaffleRule, pattern:PatternState, data, lowered, base:int, final:bool):
+		pos = pattern.pos
+		if self.is_deferred(pattern, final) is True and pattern.lead[0] is None:
+			# waits for the end, nothing is scanned
+			pos = base + len(data)
+		start = time.perf_counter()
+		self.__scan_pattern(pattern, data, lowered, base, final)
+		elapsed = time.perf_counter() - start
+		name = pattern.rex.pattern
+		if isinstance(name, bytes):
+			name = name.decode('latin-1')
+		rule.profiler.record(rule.ruleName, name, elapsed, max(base + len(data) - pos, 0))
+
+	def __skip_to_lead(self, pattern:PatternState, lowered, base:int):
+		literal, lead = pattern.lead
+		if literal is None:
+			return
+		found = lowered.find(literal, pattern.pos - base)
+		if found == -1:
+			# a match can't start before the last (partial) occurrence of its leading literal
+			pattern.pos = max(pattern.pos, base + len(lowered) - len(literal) + 1 - lead)
+			return
+		# a match might start here, the data from here on is kept until the end
+		pattern.pos = max(pattern.pos, base + found - lead)
+		pattern.lead = (None, 0)
+
+	def __scan_pattern(self, pattern:PatternState, data, lowered, base:int, final:bool):
+		"""data and lowered are the views of the buffer from the absolute offset base"""
+		if self.is_deferred(pattern, final) is True:
+			self.__skip_to_lead(pattern, lowered, base)
+			return
+		end = base + len(data)
+		limit = end if final is True else end - pattern.overlap
+		if pattern.pos >= limit and final is False:
+			return
+		start = pattern.pos - base
+		if pattern.literal is not None:
+			found = lowered.find(pattern.literal, start)
+			if found == -1:
+				if final is False:
+					pattern.pos = max(pattern.pos, limit)
+				return
+			if pattern.maxwidth is not None:
+				# the match contains the literal, it can't start earlier than this
+				start = max(start, found + len(pattern.literal) - pattern.maxwidth)
+		for match in pattern.rex.finditer(data, start):
+			if final is False and match.start() + base >= limit:
+				break
+			mstart, mend = match.start(), match.end()
+			if pattern.line is True:
+				if mstart + base < pattern.pos:
+					# another match on a line that's already reported
+					continue
+				mstart, mend = line_span(data, mstart, mend)
+			text = data[mstart:mend]
+			if self.chars_before > 0:
+				text = data[max(mstart - self.chars_before, 0) : mstart] + text
+			if self.chars_after > 0:
+				text += data[mend : min(mend + self.chars_after, len(data))]
+			if isinstance(text, bytes):
+				text = text.decode('latin-1')
+			pattern.matches.append(text)
+			pattern.pos = base + max(mend, match.start() + 1)
+			if self.first_match is True:
+				return
+		if final is False:
+			# no match starts between the last match and the limit
+			pattern.pos = max(pattern.pos, limit)
+
+	def set_error(self, err:Exception):
+		"""Marks all rules as failed, eg. when the file could not be read"""
+		for state in self.states:
+			if state.err is None:
+				state.err = err
+
+	def scan_file(self, filename:str):
+		"""Reads and scans a local file chunk by chunk"""
+		try:
+			with open(filename, 'rb') as f:
+				while self.done is False:
+					data = f.read(self.chunk_size)
+					if not data:
+						break
+					self.feed(data)
+			self.finish()
+		except Exception as e:
+			self.set_error(e)
+
+	def scan_data(self, data:bytes):
+		"""Scans an in-memory buffer holding the whole file"""
+		try:
+			self.feed(data)
+			self.finish()
+		except Exception as e:
+			self.set_error(e)
+
+	async def scan_reader(self, reader):
+		"""Scans data coming from an async generator yielding (data, err) tuples.
+		Stops consuming the generator as soon as no more data is needed"""
+		try:
+			async for data, err in reader:
+				if err is not None:
+					raise err
+				if not data:
+					break
+				self.feed(data)
+				if self.done is True:
+					break
+			self.finish()
+		except Exception as e:
+			self.set_error(e)
+		finally:
+			await reader.aclose()
+
+	def results(self) -> List[Tuple[SnaffleRule, str, Exception]]:
+		"""Returns (rule, matches, error) for every rule, in the order the rules were given.
+		Matches of a rule are joined by newlines, empty string means no match"""
+		res = []
+		for state in self.states:
+			if state.err is not None:
+				res.append((state.rule, False, state.err))
+				continue
+			matches = []
+			for pattern in state.patterns:
+				matches += pattern.matches
+			if state.detected != '':
+				matches.append(state.detected)
+			res.append((state.rule, '\r\n'.join(matches), None))
+		return res
+
+	def timings(self) -> List[Tuple[SnaffleRule, float]]:
+		"""Returns (rule, seconds spent matching it) for every rule"""
+		return [(state.rule, state.elapsed) for state in self.states]
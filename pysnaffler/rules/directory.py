@@ -7,10 +7,7 @@ class SnafflerDirectoryRule(SnaffleRule):
 		super().__init__(enumerationScope, ruleName, matchAction, relayTargets, description, matchLocation, wordListType, matchLength, wordList, triage)
 	
 	def match(self, data, **kwargs):
-		for rex in self.wordList:
-			if rex.search(data) is not None:
-				return True
-		return False
+		return self.match_wordlist(data)
 
 	def determine_action(self, data, **kwargs):
 		if self.match(data, **kwargs) is False:
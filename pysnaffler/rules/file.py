@@ -1,9 +1,20 @@
-import copy
-from pathlib import Path
 from pysnaffler.rules.constants import EnumerationScope, MatchAction, MatchLoc, MatchListType, Triage
 from typing import List
 from pysnaffler.rules.rule import SnaffleRule
 
+def get_file_extension(fullpath:str) -> str:
+	"""Returns the extension of the file used by FileExtension rules, '.bak' suffixes are ignored.
+	Follows .NET's Path.GetExtension, so '.netrc' is its own extension"""
+	if fullpath.endswith('.bak') is True:
+		fullpath = fullpath[:-4]
+	dot = fullpath.rfind('.')
+	if dot == -1 or dot == len(fullpath) - 1:
+		return ''
+	if fullpath.find('\\', dot) != -1 or fullpath.find('/', dot) != -1:
+		# the dot belongs to a directory name
+		return ''
+	return fullpath[dot:]
+
 class SnafflerFileRule(SnaffleRule):
 	def __init__(self, enumerationScope:EnumerationScope, ruleName:str, matchAction:MatchAction, relayTargets:List[str], description:str, matchLocation:MatchLoc, wordListType:MatchListType, matchLength:int, wordList:List[str], triage:Triage):
 		super().__init__(enumerationScope, ruleName, matchAction, relayTargets, description, matchLocation, wordListType, matchLength, wordList, triage)
@@ -18,28 +29,28 @@ class SnafflerFileRule(SnaffleRule):
 				raise ValueError('If smbfile is not provided, fullpath, name, and size are required for file matching')
 
 		if self.matchLocation == MatchLoc.FileName:
-			for rex in self.wordList:
-				if rex.search(name) is not None:
-					return True
+			return self.match_wordlist(name)
 		elif self.matchLocation == MatchLoc.FileExtension:
-			fullpath = copy.deepcopy(fullpath)
-			if fullpath.endswith('.bak') is True:
-				fullpath = fullpath[:-4]
-			ext = Path(fullpath).suffix
+			ext = get_file_extension(fullpath)
 			if ext == '':
 				return False
-			for rex in self.wordList:
-				if rex.search(ext) is not None:
-					return True
+			return self.match_wordlist(ext)
 		elif self.matchLocation == MatchLoc.FilePath:
-			for rex in self.wordList:
-				if rex.search(fullpath) is not None:
-					return True
+			return self.match_wordlist(fullpath)
 		elif self.matchLocation == MatchLoc.FileLength:
 			if size == self.matchLength:
 				return True
+		elif self.matchLocation == MatchLoc.FileMD5:
+			# every file is a candidate, the digest is matched by the contents scanner once the file is read
+			return True
 		return False
 
+	def lint(self) -> List[str]:
+		res = super().lint()
+		if self.matchLocation == MatchLoc.FileMD5:
+			res.append('Rule %s: FileMD5 file rules match every file by name, all files not discarded by other rules are read to compute their digest' % self.ruleName)
+		return res
+
 	def determine_action(self, smbfile, fullpath:str=None, name:str=None, size:int=None, **kwargs):
 		if self.match(smbfile, fullpath=fullpath, name=name, size=size, **kwargs) is False:
 			return None, None
@@ -0,0 +1,105 @@
+import re
+from typing import List, Tuple
+
+# CheckForKeys rules only look at the beginning of the file
+KEY_SCAN_SIZE = 1024*1024
+
+PEM_KEY_RE = re.compile(rb'-----BEGIN ((?:RSA |DSA |EC |OPENSSH |ENCRYPTED |PGP )?PRIVATE KEY(?: BLOCK)?)-----')
+PUTTY_KEY_RE = re.compile(rb'PuTTY-User-Key-File-\d+: ([\w\-@.]+)')
+
+# DER encoded OIDs
+OID_PKCS7_DATA = bytes.fromhex('2a864886f70d010701')
+OID_PKCS12_KEYBAG = bytes.fromhex('2a864886f70d010c0a0101')
+OID_PKCS12_SHROUDEDKEYBAG = bytes.fromhex('2a864886f70d010c0a0102')
+OID_PBES2 = bytes.fromhex('2a864886f70d01050d')
+OID_PKCS12_PBE = bytes.fromhex('2a864886f70d010c01') # pbeWithSHAAnd... prefix
+KEY_ALGORITHMS = {
+	bytes.fromhex('2a864886f70d010101') : 'RSA',
+	bytes.fromhex('2a8648ce3d0201') : 'EC',
+	bytes.fromhex('2a8648ce380401') : 'DSA',
+	bytes.fromhex('2b6570') : 'Ed25519',
+	bytes.fromhex('2b6571') : 'Ed448',
+}
+
+BINARY_MAGICS = [
+	(b'\x1e\xf1\xb5\xb0', 'PVK private key'),
+	(b'openssh-key-v1\x00', 'OpenSSH private key'),
+	(b'\xfe\xed\xfe\xed', 'Java keystore'),
+	(b'\xce\xce\xce\xce', 'Java JCEKS keystore'),
+]
+
+def der_header(data:bytes, pos:int) -> Tuple[int, int, int]:
+	"""Returns (tag, content length, content offset) of the DER element at pos, None if it's not valid DER"""
+	if pos + 2 > len(data):
+		return None
+	tag = data[pos]
+	length = data[pos + 1]
+	pos += 2
+	if length & 0x80:
+		count = length & 0x7f
+		if count == 0 or count > 4 or pos + count > len(data):
+			return None
+		length = int.from_bytes(data[pos:pos + count], 'big')
+		pos += count
+	return tag, length, pos
+
+def detect_der(data:bytes) -> str:
+	"""Recognises DER private key structures at the start of the data by their first few elements"""
+	outer = der_header(data, 0)
+	if outer is None or outer[0] != 0x30:
+		return None
+	first = der_header(data, outer[2])
+	if first is None:
+		return None
+	tag, length, pos = first
+	if tag == 0x02:
+		# version INTEGER
+		version = data[pos:pos + length]
+		after = der_header(data, pos + length)
+		if after is None:
+			return None
+		if version == b'\x03' and after[0] == 0x30 and data.find(OID_PKCS7_DATA, after[2], after[2] + 16) != -1:
+			if data.find(OID_PKCS12_SHROUDEDKEYBAG) != -1 or data.find(OID_PKCS12_KEYBAG) != -1:
+				return 'PKCS#12 with private key'
+			# the key bag might be inside an encrypted part
+			return 'PKCS#12 (no unencrypted key bag)'
+		if version == b'\x00' and after[0] == 0x30:
+			# PrivateKeyInfo, AlgorithmIdentifier follows
+			oid = der_header(data, after[2])
+			if oid is not None and oid[0] == 0x06:
+				algorithm = KEY_ALGORITHMS.get(data[oid[2]:oid[2] + oid[1]])
+				if algorithm is not None:
+					return 'PKCS#8 %s private key' % algorithm
+			return None
+		if version == b'\x00' and after[0] == 0x02:
+			return 'PKCS#1 RSA private key'
+		if version == b'\x01' and after[0] == 0x04:
+			return 'SEC1 EC private key'
+		return None
+	if tag == 0x30:
+		# EncryptedPrivateKeyInfo, encryption AlgorithmIdentifier first
+		oid = der_header(data, pos)
+		if oid is not None and oid[0] == 0x06:
+			value = data[oid[2]:oid[2] + oid[1]]
+			if value == OID_PBES2 or value.startswith(OID_PKCS12_PBE):
+				return 'Encrypted PKCS#8 private key'
+	return None
+
+def detect_keys(data:bytes) -> List[str]:
+	"""Returns the kinds of private keys found in the data, by their headers and structure.
+	No crypto parsing is done, the data is not validated beyond the first few DER elements"""
+	found = []
+	for m in PEM_KEY_RE.finditer(data):
+		kind = 'PEM %s' % m.group(1).decode()
+		if kind not in found:
+			found.append(kind)
+	m = PUTTY_KEY_RE.search(data)
+	if m is not None:
+		found.append('PuTTY %s private key' % m.group(1).decode())
+	for magic, kind in BINARY_MAGICS:
+		if data.startswith(magic):
+			found.append(kind)
+	kind = detect_der(data)
+	if kind is not None:
+		found.append(kind)
+	return found
@@ -0,0 +1,64 @@
+from typing import List
+
+try:
+	import re._parser as sre_parse
+	from re._constants import MAXREPEAT, MAX_REPEAT, MIN_REPEAT, SUBPATTERN, BRANCH, ASSERT, ASSERT_NOT, ANY
+except ImportError:
+	import sre_parse
+	from sre_constants import MAXREPEAT, MAX_REPEAT, MIN_REPEAT, SUBPATTERN, BRANCH, ASSERT, ASSERT_NOT, ANY
+
+try:
+	from re._constants import ATOMIC_GROUP, POSSESSIVE_REPEAT
+except ImportError:
+	# python < 3.11
+	ATOMIC_GROUP = None
+	POSSESSIVE_REPEAT = None
+
+NESTED_QUANTIFIER = 'nested quantifier, backtracking can be exponential'
+WILDCARD_SEQUENCE = 'multiple unbounded wildcards (.* or .+) in sequence, backtracking is polynomial on data without a match'
+LEADING_WILDCARD = 'starts with an unbounded wildcard, search() retries it from every position'
+
+def is_wildcard(item) -> bool:
+	return len(item) == 1 and item[0][0] is ANY
+
+def lint_sequence(items, in_repeat:bool, warnings:List[str]) -> int:
+	"""Walks a parsed pattern, returns the number of unbounded wildcards matched one after the other by it"""
+	wildcards = 0
+	for op, av in items:
+		if op is MAX_REPEAT or op is MIN_REPEAT:
+			_, hi, body = av
+			if in_repeat is True and hi > 1:
+				warnings.append(NESTED_QUANTIFIER)
+			if hi == MAXREPEAT and is_wildcard(body):
+				wildcards += 1
+			lint_sequence(body, in_repeat or hi == MAXREPEAT, warnings)
+		elif op is POSSESSIVE_REPEAT and op is not None:
+			# doesn't backtrack into the body
+			lint_sequence(av[2], False, warnings)
+		elif op is SUBPATTERN:
+			wildcards += lint_sequence(av[-1], in_repeat, warnings)
+		elif op is ATOMIC_GROUP and op is not None:
+			lint_sequence(av, False, warnings)
+		elif op is BRANCH:
+			wildcards += max(lint_sequence(branch, in_repeat, warnings) for branch in av[1])
+		elif op is ASSERT or op is ASSERT_NOT:
+			lint_sequence(av[1], in_repeat, warnings)
+	if wildcards > 1:
+		warnings.append(WILDCARD_SEQUENCE)
+	return wildcards
+
+def lint_pattern(pattern:str, flags:int = 0) -> List[str]:
+	"""Returns the constructs of a pattern prone to catastrophic backtracking, empty list if none found.
+	This is a heuristic, it doesn't prove the pattern is slow (or fast), just points at the usual suspects"""
+	try:
+		parsed = sre_parse.parse(pattern, flags)
+	except Exception:
+		# invalid patterns fail when they are compiled
+		return []
+	warnings = []
+	lint_sequence(parsed, False, warnings)
+	if len(parsed) > 0:
+		op, av = parsed[0]
+		if (op is MAX_REPEAT or op is MIN_REPEAT) and av[1] == MAXREPEAT and is_wildcard(av[2]):
+			warnings.append(LEADING_WILDCARD)
+	return list(dict.fromkeys(warnings))
@@ -0,0 +1,168 @@
+import re
+from typing import Dict, List, Tuple
+from pysnaffler.rules.constants import MatchLoc
+from pysnaffler.rules.rule import SnaffleRule
+from pysnaffler.rules.file import get_file_extension
+
+# patterns with backreferences can't be merged into a combined regex,
+# wrapping them in extra groups would change the group numbering
+BACKREF_RE = re.compile(r'\\[1-9]|\(\?P=')
+# leading global inline flags, eg. '(?s)'
+GLOBAL_FLAGS_RE = re.compile(r'^\(\?([aiLmsux]+)\)')
+# flags every wordlist regex is compiled with by SnaffleRule
+DEFAULT_FLAGS = re.IGNORECASE | re.UNICODE
+
+def scope_inline_flags(pattern:str) -> str:
+	"""Converts leading global inline flags (eg. '(?s)abc') to a scoped group ('(?s:abc)')
+	so the pattern can be embedded into a larger regex"""
+	m = GLOBAL_FLAGS_RE.match(pattern)
+	if m is None:
+		return pattern
+	return '(?%s:%s)' % (m.group(1), pattern[m.end():])
+
+def is_mergeable(rex:re.Pattern) -> bool:
+	"""Returns True if the compiled pattern can be safely embedded into a combined regex"""
+	if rex.flags != DEFAULT_FLAGS:
+		return False
+	if len(rex.groupindex) > 0:
+		return False
+	if BACKREF_RE.search(rex.pattern) is not None:
+		return False
+	return True
+
+class SnafflerPatternGroup:
+	"""Evaluates a list of rules against a single string.
+	Literal Exact/EndsWith/Contains words of all rules are merged into lowercase lookup tables.
+	The remaining patterns are compiled into a single regex where every rule is an
+	optional lookahead holding a named group, after a single match() the participating
+	groups tell which rules have matched.
+	Rules with patterns that can't be merged are evaluated one-by-one."""
+	def __init__(self, rules:List[Tuple[int, SnaffleRule]]):
+		self.exactWords:Dict[str, List[int]] = {}
+		self.suffixWords:Dict[int, Dict[str, List[int]]] = {} # suffix length -> suffix -> rule indices
+		self.containsWords:Dict[str, List[int]] = {}
+		self.groups:List[Tuple[int, int]] = [] # (group index, rule index)
+		self.fallback:List[Tuple[int, SnaffleRule]] = []
+		self.regex:re.Pattern = None
+		self.__build(rules)
+
+	def __build(self, rules:List[Tuple[int, SnaffleRule]]):
+		fragments = []
+		for idx, rule in rules:
+			for word in rule.exactWords:
+				if word not in self.exactWords:
+					self.exactWords[word] = []
+				self.exactWords[word].append(idx)
+			for word in rule.suffixWords:
+				if len(word) not in self.suffixWords:
+					self.suffixWords[len(word)] = {}
+				if word not in self.suffixWords[len(word)]:
+					self.suffixWords[len(word)][word] = []
+				self.suffixWords[len(word)][word].append(idx)
+			for word in rule.containsWords:
+				if word not in self.containsWords:
+					self.containsWords[word] = []
+				self.containsWords[word].append(idx)
+			if len(rule.regexWords) == 0:
+				continue
+			fragment = self.__rule_fragment(idx, rule)
+			if fragment is None:
+				self.fallback.append((idx, rule))
+				continue
+			fragments.append(fragment)
+
+		if len(fragments) == 0:
+			return
+		self.regex = re.compile(''.join(fragments), flags=re.IGNORECASE)
+		for name, gidx in self.regex.groupindex.items():
+			self.groups.append((gidx, int(name[2:])))
+		self.groups.sort()
+
+	def __rule_fragment(self, idx:int, rule:SnaffleRule):
+		alternatives = []
+		for rex in rule.regexWords:
+			if is_mergeable(rex) is False:
+				return None
+			pattern = scope_inline_flags(rex.pattern)
+			if pattern.startswith('^'):
+				# anchored patterns only need to be tried at the start
+				alternatives.append('(?:%s)' % pattern)
+			else:
+				# lazy prefix gives the same semantics as search()
+				alternatives.append('(?s:.*?)(?:%s)' % pattern)
+		if len(alternatives) == 0:
+			return None
+		fragment = '(?:(?=(?P<_r%d>%s))|)' % (idx, '|'.join(alternatives))
+		try:
+			re.compile(fragment, flags=re.IGNORECASE)
+		except re.error:
+			return None
+		return fragment
+
+	def match(self, data:str) -> List[int]:
+		"""Returns the indices of all rules matching data, might contain duplicates"""
+		res = []
+		if len(self.exactWords) > 0 or len(self.suffixWords) > 0 or len(self.containsWords) > 0:
+			ldata = data.lower()
+			if ldata in self.exactWords:
+				res += self.exactWords[ldata]
+			for length, suffixes in self.suffixWords.items():
+				suffix = ldata[-length:] if length > 0 else ''
+				if suffix in suffixes:
+					res += suffixes[suffix]
+			for word, indices in self.containsWords.items():
+				if word in ldata:
+					res += indices
+		if self.regex is not None:
+			m = self.regex.match(data)
+			if m.lastindex is not None:
+				for gidx, ridx in self.groups:
+					if m.start(gidx) != -1:
+						res.append(ridx)
+		for ridx, rule in self.fallback:
+			for rex in rule.regexWords:
+				if rex.search(data) is not None:
+					res.append(ridx)
+					break
+		return res
+
+class SnafflerFileRuleMatcher:
+	"""Combined matcher for all file enumeration rules of a ruleset.
+	Rules are grouped by MatchLoc, each location is evaluated by a single SnafflerPatternGroup.
+	FileMD5 rules match every file, their digest is checked once the contents are read."""
+	def __init__(self, rules:List[SnaffleRule]):
+		self.rules = rules
+		self.lengthRules:Dict[int, List[int]] = {}
+		self.digestRules:List[int] = []
+		byloc:Dict[MatchLoc, List[Tuple[int, SnaffleRule]]] = {
+			MatchLoc.FileName : [],
+			MatchLoc.FileExtension : [],
+			MatchLoc.FilePath : [],
+		}
+		for idx, rule in enumerate(rules):
+			if rule.matchLocation in byloc:
+				byloc[rule.matchLocation].append((idx, rule))
+			elif rule.matchLocation == MatchLoc.FileLength:
+				if rule.matchLength not in self.lengthRules:
+					self.lengthRules[rule.matchLength] = []
+				self.lengthRules[rule.matchLength].append(idx)
+			elif rule.matchLocation == MatchLoc.FileMD5:
+				self.digestRules.append(idx)
+
+		self.nameMatcher = SnafflerPatternGroup(byloc[MatchLoc.FileName])
+		self.extensionMatcher = SnafflerPatternGroup(byloc[MatchLoc.FileExtension])
+		self.pathMatcher = SnafflerPatternGroup(byloc[MatchLoc.FilePath])
+
+	def match(self, fullpath:str, name:str, size:int) -> List[SnaffleRule]:
+		"""Returns all rules matching the file, in the order the rules were loaded"""
+		indices = self.nameMatcher.match(name)
+		ext = get_file_extension(fullpath)
+		if ext != '':
+			indices += self.extensionMatcher.match(ext)
+		indices += self.pathMatcher.match(fullpath)
+		if size in self.lengthRules:
+			indices += self.lengthRules[size]
+		indices += self.digestRules
+		if len(indices) == 0:
+			return []
+		return [self.rules[idx] for idx in sorted(set(indices))]
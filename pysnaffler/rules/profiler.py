@@ -0,0 +1,106 @@
+import time
+import threading
+from typing import Dict, List, Tuple
+
+# number of patterns listed in the report
+PROFILE_TOP = 20
+# pattern name used for the literal (set/endswith/in) lookups of a rule
+LITERALS = '<literals>'
+
+class PatternProfile:
+	__slots__ = ('evals', 'total', 'max', 'bytes')
+	def __init__(self):
+		self.evals = 0
+		self.total = 0.0 # seconds
+		self.max = 0.0 # slowest single evaluation
+		self.bytes = 0 # size of the data the pattern was evaluated on
+
+	def add(self, evals:int, total:float, maxtime:float, size:int):
+		self.evals += evals
+		self.total += total
+		self.max = max(self.max, maxtime)
+		self.bytes += size
+
+class SnafflerRuleProfiler:
+	"""Evaluation count, total and max time and scanned bytes of every pattern of every rule.
+	Wordlist matching (share, directory and file rules, FileMD5 lookups) is timed by match_wordlist,
+	contents patterns by the content scanner on every chunk they are run on.
+	Workers profile into their own instance, take() hands over what they collected so far
+	and the parent merges it into its own. The thread backend of the match pool shares one instance,
+	updates are serialized by a lock."""
+	def __init__(self):
+		self.patterns:Dict[Tuple[str, str], PatternProfile] = {}
+		self.lock = threading.Lock()
+
+	def record(self, rulename:str, pattern:str, elapsed:float, size:int):
+		key = (rulename, pattern)
+		with self.lock:
+			profile = self.patterns.get(key)
+			if profile is None:
+				profile = PatternProfile()
+				self.patterns[key] = profile
+			profile.add(1, elapsed, elapsed, size)
+
+	def match_wordlist(self, rule, data:str) -> bool:
+		"""Same as SnaffleRule.match_wordlist, with every pattern timed separately"""
+		if len(rule.exactWords) > 0 or len(rule.suffixWords) > 0 or len(rule.containsWords) > 0:
+			start = time.perf_counter()
+			matched = rule.match_literals(data)
+			self.record(rule.ruleName, LITERALS, time.perf_counter() - start, len(data))
+			if matched is True:
+				return True
+		for rex in rule.regexWords:
+			start = time.perf_counter()
+			m = rex.search(data)
+			self.record(rule.ruleName, rex.pattern, time.perf_counter() - start, len(data))
+			if m is not None:
+				return True
+		return False
+
+	def take(self) -> Dict[Tuple[str, str], Tuple[int, float, float, int]]:
+		"""Returns the profile collected so far as plain tuples and starts a new one"""
+		with self.lock:
+			patterns = self.patterns
+			self.patterns = {}
+		res = {}
+		for key, profile in patterns.items():
+			res[key] = (profile.evals, profile.total, profile.max, profile.bytes)
+		return res
+
+	def merge(self, profile:Dict[Tuple[str, str], Tuple[int, float, float, int]]):
+		"""Adds a profile returned by take()"""
+		with self.lock:
+			for key, (evals, total, maxtime, size) in profile.items():
+				if key not in self.patterns:
+					self.patterns[key] = PatternProfile()
+				self.patterns[key].add(evals, total, maxtime, size)
+
+	def rule_totals(self) -> List[Tuple[str, PatternProfile]]:
+		"""Profiles summed per rule, slowest first"""
+		rules:Dict[str, PatternProfile] = {}
+		for (rulename, _), profile in self.patterns.items():
+			if rulename not in rules:
+				rules[rulename] = PatternProfile()
+			rules[rulename].add(profile.evals, profile.total, profile.max, profile.bytes)
+		return sorted(rules.items(), key = lambda x: x[1].total, reverse = True)
+
+	def print_report(self, top:int = PROFILE_TOP, warnings:List[str] = None):
+		"""Prints the slowest patterns and rules, ranked by total time, and the lint warnings if given"""
+		def line(name:str, profile:PatternProfile):
+			rate = profile.bytes / profile.total / (1024*1024) if profile.total > 0 else 0.0
+			return '%10.3f %10.3f %10d %12d %10.1f  %s' % (profile.total, profile.max * 1000, profile.evals, profile.bytes, rate, name)
+
+		header = '%10s %10s %10s %12s %10s  %s' % ('total(s)', 'max(ms)', 'evals', 'bytes', 'MB/s', '%s')
+		patterns = sorted(self.patterns.items(), key = lambda x: x[1].total, reverse = True)[:top]
+		print('Slowest patterns:')
+		print(header % 'rule / pattern')
+		for (rulename, pattern), profile in patterns:
+			print(line('%s / %s' % (rulename, pattern), profile))
+		print('Slowest rules:')
+		print(header % 'rule')
+		for rulename, profile in self.rule_totals()[:top]:
+			print(line(rulename, profile))
+		if warnings is not None and len(warnings) > 0:
+			print('Patterns prone to backtracking:')
+			for warning in warnings:
+				print(warning)
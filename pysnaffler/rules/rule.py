@@ -1,10 +1,39 @@
 
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Set
 import toml
 import re
 from pysnaffler.rules.constants import EnumerationScope, MatchAction, MatchLoc, MatchListType, Triage
+from pysnaffler.rules.lint import lint_pattern
+
+REGEX_METACHARS = set('.^$*+?{}[]|()')
+# FileMD5 rules may list MD5, SHA-1 or SHA-256 digests, the algorithm is picked by the length of the hex digest
+HASH_ALGORITHMS = {32: 'md5', 40: 'sha1', 64: 'sha256'}
+
+def pattern_to_literal(pattern:str):
+	"""Returns the literal string a regex pattern matches if it contains no regex metacharacters, otherwise None"""
+	res = ''
+	escaped = False
+	for c in pattern:
+		if escaped is True:
+			# escaped letters/digits are special sequences (\d, \w, \1 ...)
+			if c.isalnum() or c == '_':
+				return None
+			res += c
+			escaped = False
+		elif c == '\\':
+			escaped = True
+		elif c in REGEX_METACHARS:
+			return None
+		else:
+			res += c
+	if escaped is True:
+		return None
+	return res
 
 class SnaffleRule:
+	# set by SnafflerRuleSet.enable_profiling, wordlist matching is timed per pattern
+	profiler = None
+
 	def __init__(self, enumerationScope, RuleName, matchAction, relayTargets, description, matchLocation, wordListType, matchLength, wordList, triage) -> None:
 		self.enumerationScope:EnumerationScope = enumerationScope
 		self.ruleName:str = RuleName
@@ -16,7 +45,51 @@ class SnaffleRule:
 		self.matchLength:int = matchLength
 		self.wordList:List[re.Pattern] = wordList
 		self.triage:Triage = triage
+		self.exactWords:Set[str] = set()
+		self.suffixWords:Tuple[str] = ()
+		self.containsWords:Tuple[str] = ()
+		self.regexWords:List[re.Pattern] = []
+		self.hashAlgorithms:Tuple[str, ...] = ()
 		self.__convert_wordlist()
+		self.__split_wordlist()
+
+	def __getstate__(self):
+		state = self.__dict__.copy()
+		state.pop('profiler', None)
+		return state
+
+	def __setstate__(self, state):
+		# pickled rulesets (eg. the default one) might predate the literal lookup tables
+		self.__dict__.update(state)
+		self.__unwrap_contains()
+		self.__split_wordlist()
+
+	def is_contents_rule(self) -> bool:
+		return self.matchLocation in (MatchLoc.FileContentAsString, MatchLoc.FileContentAsBytes)
+
+	def __unwrap_contains(self):
+		# older versions converted all Contains words to '.*word.*', the wrapping only makes search() slower.
+		# Contents matches are widened to the whole line by the contents scanner instead
+		if self.wordListType != MatchListType.Contains:
+			return
+		res = []
+		for rex in self.wordList:
+			pattern = rex.pattern
+			if len(pattern) > 4 and pattern.startswith('.*') and pattern.endswith('.*'):
+				# the last '.' must not be escaped, eg. 'a\\.*'
+				backslashes = len(pattern[:-2]) - len(pattern[:-2].rstrip('\\'))
+				if backslashes % 2 == 0:
+					rex = re.compile(pattern[2:-2], flags=rex.flags)
+			res.append(rex)
+		self.wordList = res
+
+	def lint(self) -> List[str]:
+		"""Returns the warnings about patterns prone to catastrophic backtracking"""
+		res = []
+		for rex in self.wordList:
+			for warning in lint_pattern(rex.pattern, rex.flags):
+				res.append('Rule %s pattern %s: %s' % (self.ruleName, rex.pattern, warning))
+		return res
 
 	def __convert_wordlist(self):
 		#convert wordlist to regex
@@ -28,19 +101,75 @@ class SnaffleRule:
 				word = word + '$'
 			elif self.wordListType == MatchListType.StartsWith:
 				word = '^' + word
-			elif self.wordListType == MatchListType.Contains:
-				word = '.*' + word + '.*'
 			elif self.wordListType == MatchListType.Exact:
 				word = '^' + word + '$'
 			res.append(re.compile(word, flags=re.IGNORECASE))
 		self.wordList = res
 
-	
-	def match(self, data, **kwargs):
+	def __split_wordlist(self):
+		# Exact, EndsWith and Contains patterns without regex metacharacters are stored as
+		# lowercase strings so they can be matched with a set lookup / endswith / in
+		# instead of a regex search
+		exact = set()
+		suffixes = []
+		contains = []
+		regexes = []
 		for rex in self.wordList:
+			literal = None
+			if rex.flags & re.IGNORECASE:
+				if self.wordListType == MatchListType.Exact and rex.pattern.startswith('^') and rex.pattern.endswith('$'):
+					literal = pattern_to_literal(rex.pattern[1:-1])
+				elif self.wordListType == MatchListType.EndsWith and rex.pattern.endswith('$'):
+					literal = pattern_to_literal(rex.pattern[:-1])
+				elif self.wordListType == MatchListType.Contains:
+					literal = pattern_to_literal(rex.pattern)
+			if literal is None or (literal == '' and self.wordListType == MatchListType.Contains):
+				regexes.append(rex)
+			elif self.wordListType == MatchListType.Exact:
+				exact.add(literal.lower())
+			elif self.wordListType == MatchListType.Contains:
+				contains.append(literal.lower())
+			else:
+				suffixes.append(literal.lower())
+		self.exactWords = exact
+		self.suffixWords = tuple(suffixes)
+		self.containsWords = tuple(contains)
+		self.regexWords = regexes
+		algorithms = set()
+		if self.matchLocation == MatchLoc.FileMD5:
+			for word in exact:
+				algorithms.add(HASH_ALGORITHMS.get(len(word), 'md5'))
+			if len(suffixes) > 0 or len(contains) > 0 or len(regexes) > 0:
+				algorithms.add('md5')
+		self.hashAlgorithms = tuple(sorted(algorithms))
+
+	def match_literals(self, data:str) -> bool:
+		"""Returns True if any of the literal words matches data"""
+		if len(self.exactWords) == 0 and len(self.suffixWords) == 0 and len(self.containsWords) == 0:
+			return False
+		ldata = data.lower()
+		if ldata in self.exactWords:
+			return True
+		if len(self.suffixWords) > 0 and ldata.endswith(self.suffixWords):
+			return True
+		for word in self.containsWords:
+			if word in ldata:
+				return True
+		return False
+
+	def match_wordlist(self, data:str) -> bool:
+		"""Returns True if any word of the wordlist matches data"""
+		if self.profiler is not None:
+			return self.profiler.match_wordlist(self, data)
+		if self.match_literals(data) is True:
+			return True
+		for rex in self.regexWords:
 			if rex.search(data) is not None:
 				return True
 		return False
+	
+	def match(self, data, **kwargs):
+		return self.match_wordlist(data)
 
 	def determine_action(self, data, **kwargs):
 		if self.match(data, **kwargs) is False:
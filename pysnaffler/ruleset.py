@@ -1,11 +1,71 @@
 from pysnaffler.rules.constants import EnumerationScope, MatchAction, MatchLoc, MatchListType, Triage
 from typing import Dict, List, Tuple
 from pysnaffler.rules.rule import SnaffleRule
-from pathlib import PureWindowsPath
+from pysnaffler.rules.matcher import SnafflerFileRuleMatcher
+from pysnaffler.rules.contentscanner import SnafflerContentScanner
+from pysnaffler.rules.profiler import SnafflerRuleProfiler
 from glob import glob
 from aiosmb.commons.interfaces.file import SMBFile
 from typing import Union
 import hashlib
+from pysnaffler.utils import LRUCache
+from pysnaffler.archive import ArchiveLimits, ArchiveSkipped, iter_archive, read_member, read_member_all
+from pysnaffler.rules.keys import KEY_SCAN_SIZE
+
+# max number of rule combinations unroll_relays keeps
+UNROLL_CACHE_SIZE = 4096
+# max number of share/directory decisions kept by enum_share and enum_directory
+DECISION_CACHE_SIZE = 65536
+# max number of nodes in the enum_unc decision trie, it's reset when full
+UNC_TRIE_SIZE = 1000000
+
+def split_unc(unc_path:str) -> List[str]:
+	"""Splits a UNC path to host, share, directories..., file name"""
+	return [x for x in unc_path.replace('/', '\\').split('\\') if x != '' and x != '.']
+
+def is_content_rule(rule:SnaffleRule) -> bool:
+	"""True if the rule needs the file's contents, these are evaluated by the contents scanner.
+	FileMD5 rules are matched by the digest of the contents, whatever their scope"""
+	return rule.enumerationScope == EnumerationScope.ContentsEnumeration or rule.matchAction == MatchAction.CheckForKeys or rule.matchLocation == MatchLoc.FileMD5
+
+async def read_all(reader, max_size:int = 0, hasher = None) -> Tuple[bytes, Exception]:
+	"""Collects the data of an async generator yielding (data, err) tuples, at most max_size bytes if set.
+	If hasher (hashlib object) is set it's updated with the data as it comes in"""
+	buffer = bytearray()
+	try:
+		async for data, err in reader:
+			if err is not None:
+				return None, err
+			if not data:
+				break
+			if max_size > 0:
+				data = data[:max_size - len(buffer)]
+			buffer += data
+			if hasher is not None:
+				hasher.update(data)
+			if max_size > 0 and len(buffer) >= max_size:
+				break
+		return bytes(buffer), None
+	except Exception as e:
+		return None, e
+	finally:
+		await reader.aclose()
+
+def hash_file(filepath:str, hasher, max_size:int = 0, chunk_size:int = 1024*1024) -> Tuple[object, Exception]:
+	"""Updates hasher with the contents of a local file, at most max_size bytes if set"""
+	try:
+		remaining = max_size if max_size > 0 else -1
+		with open(filepath, 'rb') as f:
+			while remaining != 0:
+				data = f.read(chunk_size if remaining < 0 else min(chunk_size, remaining))
+				if not data:
+					break
+				hasher.update(data)
+				if remaining > 0:
+					remaining -= len(data)
+		return hasher, None
+	except Exception as e:
+		return None, e
 
 class SnafflerRuleSet:
 	def __init__(self):
@@ -14,14 +74,68 @@ class SnafflerRuleSet:
 		self.directoryEnumerationRules:Dict[str, SnaffleRule] = {}
 		self.contentsEnumerationRules:Dict[str, SnaffleRule] = {}
 		self.allRules:Dict[str, SnaffleRule] = {}
-		self.unrollCache:Dict[str, List[SnaffleRule]] = {}
+		self.unrollCache:Dict[Tuple[str, ...], Tuple[SnaffleRule, ...]] = {}
+		self.__fileMatcher:SnafflerFileRuleMatcher = None
+		self.__relayClosures:Dict[str, Tuple[SnaffleRule, ...]] = None
+		# decisions of enum_share and enum_directory, keyed by the lowercased path
+		self.shareCache = LRUCache(DECISION_CACHE_SIZE)
+		self.directoryCache = LRUCache(DECISION_CACHE_SIZE)
+		# share/directory decisions of enum_unc, keyed by lowercased path components
+		self.uncTrie:Dict[str, list] = {}
+		self.uncTrieSize = 0
+		# parent directory (as found in the UNC path) -> (decision, directory path inside the share)
+		self.uncParents:Dict[str, Tuple[bool, str]] = {}
+		self.profiler:SnafflerRuleProfiler = None
+
+	@property
+	def fileMatcher(self) -> SnafflerFileRuleMatcher:
+		"""Combined matcher for all file rules, compiled on first use after the rules are loaded"""
+		if self.__fileMatcher is None:
+			self.__fileMatcher = SnafflerFileRuleMatcher(list(self.fileEnumerationRules.values()))
+		return self.__fileMatcher
 
+	@property
+	def relayClosures(self) -> Dict[str, Tuple[SnaffleRule, ...]]:
+		"""The final (non-relay) rules of every Relay rule, nested relays resolved. Computed on first use after the rules are loaded"""
+		if self.__relayClosures is None:
+			closures = {}
+			for rule in self.allRules.values():
+				if rule.matchAction == MatchAction.Relay:
+					closures[rule.ruleName] = tuple(self.__resolve_relay(rule, [rule.ruleName], {}).values())
+			self.__relayClosures = closures
+		return self.__relayClosures
+
+	def __resolve_relay(self, rule:SnaffleRule, chain:List[str], finalrules:Dict[str, SnaffleRule]) -> Dict[str, SnaffleRule]:
+		for relay in rule.relayTargets:
+			if relay not in self.allRules:
+				print('Rule %s has relay target %s which is not a valid rule' % (rule.ruleName, relay))
+				continue
+			target = self.allRules[relay]
+			if target.matchAction != MatchAction.Relay:
+				if relay not in finalrules:
+					finalrules[relay] = target
+				continue
+			if relay in chain:
+				print('Relay loop detected: %s' % ' -> '.join(chain + [relay]))
+				continue
+			self.__resolve_relay(target, chain + [relay], finalrules)
+		return finalrules
 
 	def enum_share(self, sharename) -> Tuple[bool, List[Triage]]:
 		"""Returns True if the share should be enumerated, False if it should be discarded."""
-		rules = []
 		if sharename.startswith('\\\\') is False:
 			sharename = '\\\\' + sharename
+		# rules are case insensitive, so is the cache
+		key = sharename.lower()
+		res = self.shareCache.get(key)
+		if res is not None:
+			return res
+		res = self.__enum_share(sharename)
+		self.shareCache.put(key, res)
+		return res
+
+	def __enum_share(self, sharename) -> Tuple[bool, List[Triage]]:
+		rules = []
 		for rule in self.shareEnumerationRules.values():
 			action, triage = rule.determine_action(sharename)
 			if action is MatchAction.Discard:
@@ -31,9 +145,19 @@ class SnafflerRuleSet:
 		return True, rules
 
 	def enum_directory(self, directory) -> Tuple[bool, List[Triage]]:
-		rules = []
+		"""Returns True if the directory should be enumerated, False if it should be discarded."""
 		if directory.startswith('\\') is False:
 			directory = '\\' + directory
+		key = directory.lower()
+		res = self.directoryCache.get(key)
+		if res is not None:
+			return res
+		res = self.__enum_directory(directory)
+		self.directoryCache.put(key, res)
+		return res
+
+	def __enum_directory(self, directory) -> Tuple[bool, List[Triage]]:
+		rules = []
 		for rule in self.directoryEnumerationRules.values():
 			action, triage = rule.determine_action(directory)
 			if action is MatchAction.Discard:
@@ -46,15 +170,21 @@ class SnafflerRuleSet:
 	def enum_file(self, smbfile:Union[SMBFile, None], fullpath:str=None, name:str=None, size:int=None) -> Tuple[bool, List[SnaffleRule]]:
 		"""Returns True if the file should be enumerated, False if it should be discarded.
 		Returns a list of rules that matched the file."""
-		rules = []
-		for rule in self.fileEnumerationRules.values():
-			res, triage = rule.determine_action(smbfile, fullpath=fullpath, name=name, size=size)
-			if res is None:
-				continue
-			if res == MatchAction.Discard:
+		if smbfile is not None:
+			fullpath = smbfile.fullpath
+			name = smbfile.name
+			size = smbfile.size
+		elif fullpath is None or name is None or size is None:
+			raise ValueError('If smbfile is not provided, fullpath, name, and size are required for file matching')
+
+		if self.profiler is not None:
+			# the combined matcher would hide the cost of the single rules
+			rules = [rule for rule in self.fileEnumerationRules.values() if rule.match(None, fullpath, name, size) is True]
+		else:
+			rules = self.fileMatcher.match(fullpath, name, size)
+		for rule in rules:
+			if rule.matchAction == MatchAction.Discard:
 				return False, [rule]
-			else:
-				rules.append(rule)
 
 		# By default, we don't want to download files that don't match any rules
 		if len(rules) == 0:
@@ -63,32 +193,109 @@ class SnafflerRuleSet:
 		return True, rules
 			  
 	def enum_unc(self, unc_path:str, fsize:int = None):
-		unc = PureWindowsPath('\\\\\\\\' + unc_path.lstrip('\\'))
-		share = unc.parts[2]
-		shareres = self.enum_share(share)
-		if shareres[0] is False:
-			return False, []
-		for x in unc.parts[2:-1]:
-			dirres = self.enum_directory(x) 
-			if dirres[0] is False:
+		"""Evaluates a file by its UNC path the same way the live enumeration would:
+		share rules on the share, directory rules on every parent directory, then the file rules"""
+		sep = unc_path.rfind('\\')
+		cached = self.uncParents.get(unc_path[:sep])
+		name = unc_path[sep+1:]
+		if cached is None or name == '' or name == '.' or '/' in name:
+			parts = split_unc(unc_path)
+			if len(parts) < 3:
+				# no file part
 				return False, []
-		smbfile = SMBFile.from_uncpath(unc_path)
-		smbfile.size = 1000 if fsize is None else int(fsize)
-		to_dl, rules = self.enum_file(smbfile)
+			cached = (self.__enum_unc_dirs(parts), '\\'.join(parts[2:-1]))
+			if sep > 0 and parts[-1] == name:
+				# any other file name under the same parent splits to the same directories
+				if len(self.uncParents) >= UNC_TRIE_SIZE:
+					self.uncParents = {}
+				self.uncParents[unc_path[:sep]] = cached
+			name = parts[-1]
+		todl, dirpath = cached
+		if todl is False:
+			return False, []
+		size = 1000 if fsize is None else int(fsize)
+		to_dl, rules = self.enum_file(None, dirpath + '\\' + name if dirpath != '' else name, name, size)
 		if to_dl is False:
 			return False, []
-		rules = self.unroll_relays(rules)
-		return True, rules
+		return True, self.unroll_relays(rules)
+
+	def __enum_unc_dirs(self, parts:List[str]) -> bool:
+		"""Share and directory decisions for the parents of a file (parts: host, share, directories..., name).
+		Directories are checked by their full path inside the share, eg. '\\a', '\\a\\b'.
+		Decisions are stored in a trie of path components, so files in the same directory reuse them"""
+		if self.uncTrieSize >= UNC_TRIE_SIZE:
+			self.uncTrie = {}
+			self.uncTrieSize = 0
+			self.uncParents = {}
+		key = parts[1].lower()
+		node = self.uncTrie.get(key)
+		if node is None:
+			# node: [decision, children]
+			node = [self.enum_share(parts[1])[0], {}]
+			self.uncTrie[key] = node
+			self.uncTrieSize += 1
+		for i in range(2, len(parts) - 1):
+			if node[0] is False:
+				return False
+			key = parts[i].lower()
+			child = node[1].get(key)
+			if child is None:
+				child = [self.enum_directory('\\'.join(parts[2:i+1]))[0], {}]
+				node[1][key] = child
+				self.uncTrieSize += 1
+			node = child
+		return node[0]
+
+	def enum_unc_batch(self, entries:List[Tuple[str, int]]) -> List[Tuple[bool, Tuple[SnaffleRule, ...], Exception]]:
+		"""Same as enum_unc for a batch of (unc path, file size) entries, returns (to_dl, rules, error) for each"""
+		res = []
+		for unc_path, fsize in entries:
+			try:
+				todl, rules = self.enum_unc(unc_path, fsize)
+				res.append((todl, rules, None))
+			except Exception as e:
+				res.append((False, [], e))
+		return res
+
+	def enable_profiling(self) -> SnafflerRuleProfiler:
+		"""Times every pattern of every rule, see SnafflerRuleProfiler. Matching gets slower while enabled"""
+		if self.profiler is None:
+			self.profiler = SnafflerRuleProfiler()
+		for rule in self.allRules.values():
+			rule.profiler = self.profiler
+		return self.profiler
+
+	def lint(self) -> List[str]:
+		"""Returns the warnings about patterns prone to catastrophic backtracking, for all rules"""
+		res = []
+		for rule in self.allRules.values():
+			res += rule.lint()
+		return res
+
+	def print_lint(self):
+		"""Prints the lint warnings, called once when the ruleset is loaded"""
+		for warning in self.lint():
+			print('WARNING: %s' % warning)
 
 	def load_rule(self, rule):
 		"""Adds a single rule to the ruleset"""
 		self.allRules[rule.ruleName] = rule
+		if self.profiler is not None:
+			rule.profiler = self.profiler
+		self.__relayClosures = None
+		self.unrollCache = {}
+		self.shareCache.clear()
+		self.directoryCache.clear()
+		self.uncTrie = {}
+		self.uncTrieSize = 0
+		self.uncParents = {}
 		if rule.enumerationScope == EnumerationScope.ShareEnumeration:
 			self.shareEnumerationRules[rule.ruleName] = rule
 		elif rule.enumerationScope == EnumerationScope.DirectoryEnumeration:
 			self.directoryEnumerationRules[rule.ruleName] = rule
 		elif rule.enumerationScope == EnumerationScope.FileEnumeration:
 			self.fileEnumerationRules[rule.ruleName] = rule
+			self.__fileMatcher = None
 		elif rule.enumerationScope == EnumerationScope.ContentsEnumeration:
 			self.contentsEnumerationRules[rule.ruleName] = rule
 
@@ -143,54 +350,139 @@ class SnafflerRuleSet:
 		return SnafflerRuleSet.from_dict(pickle.loads(gzip.decompress(base64.b64decode(pickled))))
 
 	@staticmethod
-	def load_default_ruleset():
+	def load_default_ruleset(lint:bool = True):
 		from pysnaffler.rulefiles import get_default_ruleset
-		return get_default_ruleset()
+		ruleset = get_default_ruleset()
+		if lint is True:
+			ruleset.print_lint()
+		return ruleset
 
 	@staticmethod
-	def from_directory(dirpath):
+	def from_directory(dirpath, lint:bool = True):
 		"""Load all rules from a directory recirsively"""
 		ruleset = SnafflerRuleSet()
 		ruleset.load_directory(dirpath)
+		if lint is True:
+			ruleset.print_lint()
 		return ruleset
 
 	@staticmethod
-	def from_file(filepath):
+	def from_file(filepath, lint:bool = True):
 		"""Load all rules from a single file"""
 		ruleset = SnafflerRuleSet()
 		ruleset.load_rule_file(filepath)
+		if lint is True:
+			ruleset.print_lint()
 		return ruleset
 	
-	def unroll_relays(self, rules:List[SnaffleRule]) -> List[SnaffleRule]:
-		lookupkey = ''
-		for rule in rules:
-			lookupkey += rule.ruleName
+	def unroll_relays(self, rules:List[SnaffleRule]) -> Tuple[SnaffleRule, ...]:
+		"""Replaces the Relay rules with the rules they relay to. Results are cached per rule combination"""
+		lookupkey = tuple([rule.ruleName for rule in rules])
 		if lookupkey in self.unrollCache:
 			return self.unrollCache[lookupkey]
 
+		closures = self.relayClosures
 		finalrules = {}
 		for rule in rules:
 			if rule.matchAction == MatchAction.Relay:
-				# I can only hope there won't be nested relays
-				# or worse: recursive relays...
-				for relay in rule.relayTargets:
-					if relay in self.allRules:
-						if relay not in finalrules:
-							finalrules[relay] = self.allRules[relay]
-						# keep it like this so we know which rule is already in the set
-						# and which one is missing
-					else:
-						print('Rule %s has relay target %s which is not a valid rule' % (rule.ruleName, relay))
+				if rule.ruleName not in closures:
+					# rule is not part of the ruleset
+					closures[rule.ruleName] = tuple(self.__resolve_relay(rule, [rule.ruleName], {}).values())
+				for target in closures[rule.ruleName]:
+					if target.ruleName not in finalrules:
+						finalrules[target.ruleName] = target
 			else:
 				finalrules[rule.ruleName] = rule
-		self.unrollCache[lookupkey] = finalrules.values()
-		return finalrules.values()
+		if len(self.unrollCache) >= UNROLL_CACHE_SIZE:
+			self.unrollCache.clear()
+		self.unrollCache[lookupkey] = tuple(finalrules.values())
+		return self.unrollCache[lookupkey]
 
-	async def parse_file(self, filepath, rules:List[SnaffleRule], fsize:int = 0, chars_before_match:int = 0, chars_after_match:int = 0):
+	def scan_contents(self, rulenames:List[str], filepath:str = None, data:bytes = None, chars_before_match:int = 0, chars_after_match:int = 0, first_match:bool = False, max_scan_bytes:int = 0) -> List[Tuple[str, str, Exception, float]]:
+		"""Runs the contents rules on a local file or an in-memory buffer in a single pass.
+		Rules are referenced by name so this can be called in a worker process holding a copy of the ruleset.
+		Returns (rule name, matches, error, seconds spent matching) for every rule"""
+		rules = [self.allRules[name] for name in rulenames]
+		scanner = SnafflerContentScanner(rules, chars_before_match, chars_after_match, first_match = first_match, max_bytes = max_scan_bytes)
+		if data is not None:
+			scanner.scan_data(data)
+		else:
+			scanner.scan_file(filepath)
+		return [(rule.ruleName, res, err, elapsed) for (rule, res, err), (_, elapsed) in zip(scanner.results(), scanner.timings())]
+
+	async def parse_file(self, filepath, rules:List[SnaffleRule], fsize:int = 0, chars_before_match:int = 0, chars_after_match:int = 0, data:bytes = None, reader = None, first_match:bool = False, max_scan_bytes:int = 0, pool = None, cache:LRUCache = None, metrics = None):
+		"""Evaluates the rules on a file. If data or reader (async generator yielding (data, err)) is set the contents
+		are taken from it and the file is not opened, filepath is then only used for the path-based rules.
+		With first_match every contents rule stops at its first match, max_scan_bytes limits how much of the file is scanned.
+		If pool (SnafflerMatchPool) is set the contents matching runs there instead of in the event loop.
+		If cache is set the contents are hashed (a reader is read to the end first) and the contents rules
+		results of already seen contents are taken from the cache instead of matching again.
+		If metrics (SnafflerMetrics) is set the time spent matching each contents rule is recorded there."""
 		finalrules = self.unroll_relays(rules)
+		# all contents rules are evaluated in a single pass over the file
+		contentresults = {}
+		contentrules = [rule for rule in finalrules if is_content_rule(rule)]
+		cachekey = None
+		if len(contentrules) > 0 and cache is not None:
+			hasher = hashlib.sha256()
+			if reader is not None:
+				data, err = await read_all(reader, max_scan_bytes, hasher)
+				reader = None
+			elif data is not None:
+				data = data[:max_scan_bytes] if max_scan_bytes > 0 else data
+				hasher.update(data)
+				err = None
+			else:
+				hasher, err = hash_file(filepath, hasher, max_scan_bytes)
+			if err is not None:
+				for rule in contentrules:
+					contentresults[rule.ruleName] = (False, err)
+			else:
+				cachekey = (hasher.digest(), tuple(sorted(rule.ruleName for rule in contentrules)), chars_before_match, chars_after_match, first_match, max_scan_bytes)
+				contentresults = cache.get(cachekey, {})
+
+		# nothing to match if the results came from the cache or the contents could not be read
+		matchcontents = len(contentrules) > 0 and len(contentresults) == 0
+		if matchcontents is True and pool is not None:
+			rulenames = [rule.ruleName for rule in contentrules]
+			err = None
+			if reader is not None:
+				# the pool needs the whole (budget-limited) data at once
+				data, err = await read_all(reader, max_scan_bytes)
+			if err is not None:
+				results = [(name, False, err, 0.0) for name in rulenames]
+			else:
+				results = await pool.scan_contents(rulenames, filepath, data, chars_before_match, chars_after_match, first_match, max_scan_bytes)
+			for name, res, err, _ in results:
+				contentresults[name] = (res, err)
+			if metrics is not None:
+				metrics.contents_matched([(name, elapsed) for name, _, _, elapsed in results])
+		elif matchcontents is True:
+			scanner = SnafflerContentScanner(contentrules, chars_before_match, chars_after_match, first_match = first_match, max_bytes = max_scan_bytes)
+			if reader is not None:
+				await scanner.scan_reader(reader)
+			elif data is not None:
+				scanner.scan_data(data)
+			else:
+				scanner.scan_file(filepath)
+			for rule, res, err in scanner.results():
+				contentresults[rule.ruleName] = (res, err)
+			if metrics is not None:
+				metrics.contents_matched([(rule.ruleName, elapsed) for rule, elapsed in scanner.timings()])
+		elif reader is not None:
+			await reader.aclose()
+
+		if cachekey is not None and cachekey not in cache and all(err is None for _, err in contentresults.values()):
+			cache.put(cachekey, contentresults)
+
+		for rule in contentrules:
+			if rule.matchAction == MatchAction.Discard and contentresults[rule.ruleName][0]:
+				# eg. a known benign file by its hash, nothing is reported for it
+				return
+
 		for rule in finalrules:
-			if rule.enumerationScope == EnumerationScope.ContentsEnumeration:
-				res, err = rule.open_and_match(filepath, chars_before_match, chars_after_match)
+			if is_content_rule(rule):
+				res, err = contentresults[rule.ruleName]
 				if err is not None:
 					yield None, rule, err
 				if res:
@@ -207,6 +499,95 @@ class SnafflerRuleSet:
 				res = ''
 				yield res, rule, None
 
+	def read_limit(self, rules:List[SnaffleRule]) -> int:
+		"""Returns how much of the file the rules (after unrolling the relays) need, 0 if the whole file is needed.
+		Files only checked for keys need just their beginning"""
+		limit = 0
+		for rule in self.unroll_relays(rules):
+			if rule.matchAction == MatchAction.CheckForKeys:
+				limit = KEY_SCAN_SIZE
+			elif is_content_rule(rule) is True or rule.matchAction == MatchAction.EnterArchive:
+				return 0
+		return limit
+
+	def is_archive(self, rules:List[SnaffleRule]) -> bool:
+		"""True if the rules (after unrolling the relays) ask for the file to be opened as an archive"""
+		for rule in self.unroll_relays(rules):
+			if rule.matchAction == MatchAction.EnterArchive:
+				return True
+		return False
+
+	async def parse_archive(self, unc_path:str, rules:List[SnaffleRule], fsize:int = 0, chars_before_match:int = 0, chars_after_match:int = 0, filepath:str = None, data:bytes = None, reader = None, first_match:bool = False, max_scan_bytes:int = 0, pool = None, cache:LRUCache = None, limits:ArchiveLimits = None, depth:int = 0, metrics = None):
+		"""Same as parse_file, but files matching an EnterArchive rule are opened as archives and all their members are
+		evaluated by the file rules and the contents rules, without extracting them to disk. Nested archives are opened as well, within limits.
+		The file is taken from filepath (local file), data or reader, unc_path is used for naming.
+		Yields (unc path, size, result, rule, error), the UNC path of a member is the archive's UNC path followed by the member's path.
+		Archives that are not opened (unknown format, limits reached) are reported as skipped results, not as errors"""
+		if self.is_archive(rules) is False:
+			async for res, rule, err in self.parse_file(filepath if filepath is not None else unc_path, rules, fsize, chars_before_match, chars_after_match, data = data, reader = reader, first_match = first_match, max_scan_bytes = max_scan_bytes, pool = pool, cache = cache, metrics = metrics):
+				if isinstance(err, ArchiveSkipped):
+					# member cut by the archive size limit
+					res, err = str(err), None
+				yield unc_path, fsize, res, rule, err
+			return
+
+		finalrules = self.unroll_relays(rules)
+		archiverule = [rule for rule in finalrules if rule.matchAction == MatchAction.EnterArchive][0]
+		# EnterArchive rules only tell to open the file, they are not reported
+		ownrules = [rule for rule in finalrules if rule.matchAction != MatchAction.EnterArchive]
+		if limits is None:
+			limits = ArchiveLimits()
+		if reader is not None:
+			# archives need random access
+			data, err = await read_all(reader)
+			if err is not None:
+				yield unc_path, fsize, None, archiverule, err
+				return
+		# rules of the archive file itself
+		async for res, rule, err in self.parse_file(filepath if filepath is not None else unc_path, ownrules, fsize, chars_before_match, chars_after_match, data = data, first_match = first_match, max_scan_bytes = max_scan_bytes, pool = pool, cache = cache, metrics = metrics):
+			yield unc_path, fsize, res, rule, err
+		if depth >= limits.max_depth:
+			return
+
+		members, err = iter_archive(unc_path.rsplit('\\', 1)[-1], filepath, data)
+		if isinstance(err, ArchiveSkipped):
+			yield unc_path, fsize, str(err), archiverule, None
+			return
+		if err is not None:
+			yield unc_path, fsize, None, archiverule, err
+			return
+		try:
+			for member in members:
+				if limits.members <= 0 or limits.remaining <= 0 or member.size > limits.remaining:
+					yield unc_path, fsize, 'Skipped the rest of the archive due to archive limits', archiverule, None
+					return
+				limits.members -= 1
+				mpath = unc_path + '\\' + member.path
+				mname = member.path.rsplit('\\', 1)[-1]
+				# the file rules see the archive as a directory
+				tograb, mrules = self.enum_file(None, '\\'.join(split_unc(mpath)[2:]), mname, max(member.size, 0))
+				if tograb is False:
+					continue
+				if self.is_archive(mrules) is True:
+					mdata, err = await read_member_all(member, limits)
+					if isinstance(err, ArchiveSkipped):
+						yield mpath, member.size, str(err), archiverule, None
+						continue
+					if err is not None:
+						yield mpath, member.size, None, archiverule, err
+						continue
+					mreader = None
+				else:
+					mdata = None
+					mreader = read_member(member, limits)
+				async for res in self.parse_archive(mpath, mrules, max(member.size, 0), chars_before_match, chars_after_match, data = mdata, reader = mreader, first_match = first_match, max_scan_bytes = max_scan_bytes, pool = pool, cache = cache, limits = limits, depth = depth + 1, metrics = metrics):
+					yield res
+		except Exception as e:
+			# corrupt archive
+			yield unc_path, fsize, None, archiverule, e
+		finally:
+			members.close()
+
 if __name__ == '__main__':
-	ruleset = SnafflerRuleSet.load_default_ruleset()
+	ruleset = SnafflerRuleSet.load_default_ruleset(lint = False)
 	print(ruleset.pickle())
\ No newline at end of file
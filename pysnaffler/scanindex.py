@@ -0,0 +1,73 @@
+import time
+import json
+import asyncio
+import sqlite3
+import threading
+from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+
+# index rows are written in batches of this size...
+INDEX_BATCH_SIZE = 1000
+# ...or after this many seconds, whichever comes first
+INDEX_FLUSH_INTERVAL = 5
+
+class SnafflerScanIndex:
+	"""On-disk index of the files processed by previous scans, backed by SQLite.
+	Keyed by host and path, stores the size, last write time and the rule outcomes of every processed file.
+	A file with the same size, last write time and tag (matching rules and scan settings) doesn't need to be processed again,
+	its stored results are still valid. Writes are buffered and committed in batches.
+	get_async runs the lookup on the index's own thread, so the event loop isn't blocked by the disk."""
+	def __init__(self, path:str, batch_size:int = INDEX_BATCH_SIZE, flush_interval:float = INDEX_FLUSH_INTERVAL):
+		self.path = path
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.buffer = []
+		self.last_flush = time.monotonic()
+		self.hits = 0
+		self.misses = 0
+		self.lock = threading.Lock() # the connection is shared by the lookup thread and the writers
+		self.executor = ThreadPoolExecutor(1)
+		self.db = sqlite3.connect(path, check_same_thread = False)
+		self.db.execute('CREATE TABLE IF NOT EXISTS files (target TEXT, path TEXT, size INTEGER, last_write_time TEXT, tag TEXT, results TEXT, PRIMARY KEY (target, path))')
+		self.db.commit()
+
+	def get(self, target:str, path:str, size:int, last_write_time:str, tag:str) -> List[Tuple[str, str]]:
+		"""Returns the stored (rule name, data) results of the file, None if the file is unknown or changed since"""
+		if last_write_time is None:
+			return None
+		with self.lock:
+			row = self.db.execute('SELECT size, last_write_time, tag, results FROM files WHERE target = ? AND path = ?', (str(target), path)).fetchone()
+			if row is None or row[0] != size or row[1] != last_write_time or row[2] != tag:
+				self.misses += 1
+				return None
+			self.hits += 1
+		return [tuple(x) for x in json.loads(row[3])]
+
+	async def get_async(self, target:str, path:str, size:int, last_write_time:str, tag:str) -> List[Tuple[str, str]]:
+		"""Same as get, but awaitable"""
+		if last_write_time is None:
+			return None
+		loop = asyncio.get_running_loop()
+		return await loop.run_in_executor(self.executor, self.get, target, path, size, last_write_time, tag)
+
+	def put(self, target:str, path:str, size:int, last_write_time:str, tag:str, results:List[Tuple[str, str]]):
+		if last_write_time is None:
+			return
+		self.buffer.append((str(target), path, size, last_write_time, tag, json.dumps(results)))
+		if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+			self.flush()
+
+	def flush(self):
+		self.last_flush = time.monotonic()
+		if len(self.buffer) == 0:
+			return
+		rows = self.buffer
+		self.buffer = []
+		with self.lock:
+			self.db.executemany('INSERT OR REPLACE INTO files (target, path, size, last_write_time, tag, results) VALUES (?, ?, ?, ?, ?, ?)', rows)
+			self.db.commit()
+
+	def close(self):
+		self.executor.shutdown()
+		self.flush()
+		self.db.close()
@@ -1,4 +1,4 @@
-import datetime
+import time
 import asyncio
 import traceback
 from pathlib import Path
@@ -6,47 +6,84 @@ from typing import List
 from asysocks.unicomm.common.scanner.common import *
 from pysnaffler.protocol import NFSProtocolClient, ProtocolClient, SMBProtocolClient
 from pysnaffler.rules.rule import SnaffleRule
+from pysnaffler.rules.constants import MatchLoc
 
 from aiosmb.commons.interfaces.machine import SMBMachine
 from aiosmb.commons.interfaces.file import SMBFile
 from aiosmb.commons.connection.factory import SMBConnectionFactory
-from aiosmb.examples.scanners.smbfile import SMBFileRes
 from pysnaffler.snaffler import pySnaffler
-from pysnaffler.utils import sizeof_fmt
+from pysnaffler.journal import HostProgress, journal_key
+from pysnaffler.utils import sizeof_fmt, utc_timestamp
 
 from anfs.protocol.nfs3.common.factory import NFS3ConnectionFactory
 
+# download queue length per download worker, enumeration blocks when the queue is full
+QUEUE_SIZE_PER_WORKER = 2
+
+# single pass escaping of the data column, backslashes first would double escape the others
+DATA_ESCAPE = str.maketrans({'\\' : '\\\\', '\r' : '\\r', '\t' : '\\t', '\n' : '\\n'})
+
+def get_last_write_time(smbfile:SMBFile) -> str:
+	if smbfile.last_write_time is None:
+		return None
+	return smbfile.last_write_time.isoformat()
+
 class SnafflerResult:
+	"""A rule match. Only keeps the fields of the object and the rule the output needs,
+	the SMB objects are not referenced after the result is created"""
+	__slots__ = ('otype', 'name', 'unc_path', 'size', 'last_write_time', 'triage', 'rule_name', 'data')
 	def __init__(self, otype:str, smbobj, rule:SnaffleRule, data:str or bytes = None):
 		self.otype = otype
-		self.smbobj = smbobj
-		self.rule = rule
+		self.name = smbobj.name
+		self.unc_path = smbobj.unc_path
+		self.size = 0
+		self.last_write_time = None
+		if otype == 'file':
+			self.size = smbobj.size
+			self.last_write_time = get_last_write_time(smbobj)
+		self.triage = rule.triage.name
+		self.rule_name = rule.ruleName
 		self.data = data
 
 	def get_name(self):
 		return 'Snaffler'
 
 	def get_fname(self):
-		return self.smbobj.name
+		return self.name
 
 	def get_fdata(self):
 		return None
 
 	def data_to_line(self):
-		# data needs to be one single line, so we replace newlines with spaces
+		# data needs to be one single line, so we escape backslashes, newlines and tabs
 		if self.data is None:
 			return ''
-		return str(self.data).replace('\r', '\\r').replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+		return str(self.data).translate(DATA_ESCAPE)
+
+	def get_header(self):
+		return ['timestamp', 'otype', 'triage', 'rule', 'size', 'last_write_time', 'path', 'data']
+
+	def to_dict(self):
+		return {
+			'timestamp' : utc_timestamp(),
+			'otype' : self.otype,
+			'triage' : self.triage,
+			'rule' : self.rule_name,
+			'size' : self.size,
+			'last_write_time' : self.last_write_time,
+			'path' : self.unc_path,
+			'data' : None if self.data is None else str(self.data),
+		}
 
 	def to_line(self):
 		try:
 			# tab separater line containing filename, rule triage color, file size, file size in human readable format,  file last modified date, full unc path, data.
 			if self.otype == 'file':
-				return '%s\t[File]\t%s\t%s\tR\t%s\t%s\t%s\t%s\t%s' % (datetime.datetime.utcnow().isoformat(), self.rule.triage.name, self.rule.ruleName, self.smbobj.size, sizeof_fmt(self.smbobj.size), self.smbobj.last_write_time.isoformat(), self.smbobj.unc_path, self.data_to_line())
+				return '%s\t[File]\t%s\t%s\tR\t%s\t%s\t%s\t%s\t%s' % (utc_timestamp(), self.triage, self.rule_name, self.size, sizeof_fmt(self.size), self.last_write_time or '', self.unc_path, self.data_to_line())
 			elif self.otype == 'dir':
-				return '%s\t[Dir]\t%s\t%s\tR\t%s\t%s\t%s\t%s\t%s' % (datetime.datetime.utcnow().isoformat(), self.rule.triage.name, self.rule.ruleName, '0', '', '', self.smbobj.unc_path, '')
+				return '%s\t[Dir]\t%s\t%s\tR\t%s\t%s\t%s\t%s\t%s' % (utc_timestamp(), self.triage, self.rule_name, '0', '', '', self.unc_path, '')
 			elif self.otype == 'share': 
-				return '%s\t[Share]\t%s\t%s\tR\t%s\t%s\t%s\t%s\t%s' % (datetime.datetime.utcnow().isoformat(), self.rule.triage.name, self.rule.ruleName, '0', '', '', self.smbobj.unc_path, '')
+				return '%s\t[Share]\t%s\t%s\tR\t%s\t%s\t%s\t%s\t%s' % (utc_timestamp(), self.triage, self.rule_name, '0', '', '', self.unc_path, '')
 		except Exception as e:
 			traceback.print_exc()
 			raise e
@@ -54,24 +91,113 @@ class SnafflerResult:
 	def __str__(self):
 		return self.to_line()
 
+class SnafflerFileListEntry:
+	"""Filelist (-l) record of an enumerated object, same output as aiosmb's SMBFileRes
+	without keeping a reference to the object"""
+	__slots__ = ('otype', 'unc_path', 'creationtime', 'size', 'sddl')
+	def __init__(self, otype:str, obj):
+		self.otype = otype
+		self.unc_path = str(obj.unc_path)
+		self.creationtime = ''
+		self.size = None
+		self.sddl = ''
+		if otype == 'dir' or otype == 'file':
+			if obj.creation_time is not None:
+				self.creationtime = obj.creation_time.isoformat()
+		if otype == 'file':
+			self.size = obj.size
+		security_descriptor = getattr(obj, 'security_descriptor', None)
+		if security_descriptor is not None:
+			self.sddl = str(security_descriptor.to_sddl())
+
+	def get_name(self):
+		# same output file name as the SMBFileRes records had
+		return 'SMBFileRes'
+
+	def get_fname(self):
+		return None
+
+	def get_fdata(self):
+		return None
+
+	def get_header(self):
+		return ['otype', 'path', 'creationtime', 'size', 'sizefmt', 'sddl']
+
+	def to_line(self, separator = '\t'):
+		if self.otype == 'file':
+			return separator.join([self.otype, self.unc_path, self.creationtime, str(self.size), sizeof_fmt(self.size), self.sddl])
+		return separator.join([self.otype, self.unc_path, self.creationtime, '0', '', self.sddl])
+
+	def to_dict(self):
+		if self.otype == 'file':
+			return {
+				'otype' : self.otype,
+				'path' : self.unc_path,
+				'creationtime' : self.creationtime,
+				'size' : self.size,
+				'sizefmt' : sizeof_fmt(self.size),
+				'sddl' : self.sddl
+			}
+		if self.otype == 'dir':
+			return {
+				'otype' : self.otype,
+				'path' : self.unc_path,
+				'creationtime' : self.creationtime,
+				'sddl' : self.sddl
+			}
+		return {
+			'otype' : self.otype,
+			'path' : self.unc_path,
+			'sddl' : self.sddl
+		}
+
 class SnafflerScanner:
 	"""This is an interface object for aiosmb's scanner"""
 	def __init__(self, factory:SMBConnectionFactory, snaffler:pySnaffler):
 		self.factory = factory
 		self.snaffler = snaffler
-		self.download_semaphore = asyncio.Semaphore(snaffler.max_downloads)
-		self.download_tasks = []
+		self.info_last = {} # target -> time of the last progress message sent
+
+	def send_info(self, target, out_queue:asyncio.Queue, msg:str, sampled:bool = True):
+		"""Info messages never block the scan, they are dropped (and counted) when the output queue is full.
+		Sampled (progress) messages are sent at most once per info_interval seconds per host"""
+		if sampled is True and self.snaffler.info_interval > 0:
+			now = time.monotonic()
+			last = self.info_last.get(target)
+			if last is not None and now - last < self.snaffler.info_interval:
+				self.snaffler.stat_info_sampled += 1
+				return
+			self.info_last[target] = now
+		try:
+			out_queue.put_nowait(ScannerInfo(target, msg))
+		except asyncio.QueueFull:
+			self.snaffler.stat_info_dropped += 1
 
-	async def __filter_share_and_dir(self, otype, obj):
+	async def __filter_share_and_dir(self, otype, obj, progress:HostProgress = None):
 		"""Filter function for SMBMachine.enum_files_with_filter, this is the callback"""
 		# return True to continue enumeration, False to stop
 		try:                
 			if otype == 'dir':
-				return self.snaffler.ruleset.enum_directory(obj.fullpath)[0]
+				if progress is not None and progress.is_dir_done(journal_key(obj.unc_path)) is True:
+					return False
+				start = time.perf_counter()
+				tograb = self.snaffler.ruleset.enum_directory(obj.fullpath)[0]
+				self.snaffler.metrics.rule_scope('dir', time.perf_counter() - start)
+				return tograb
 			if otype == 'share':
-				return self.snaffler.ruleset.enum_share(obj.name)[0]
+				if progress is not None and progress.is_dir_done(obj.name.lower()) is True:
+					return False
+				start = time.perf_counter()
+				tograb = self.snaffler.ruleset.enum_share(obj.name)[0]
+				self.snaffler.metrics.rule_scope('share', time.perf_counter() - start)
+				return tograb
 			elif otype == 'sharename':
-				return self.snaffler.ruleset.enum_share(obj)[0]
+				if progress is not None and progress.is_dir_done(obj.lower()) is True:
+					return False
+				start = time.perf_counter()
+				tograb = self.snaffler.ruleset.enum_share(obj)[0]
+				self.snaffler.metrics.rule_scope('share', time.perf_counter() - start)
+				return tograb
 			else:
 				print('%s is not a share or directory' % otype)
 			return True
@@ -80,65 +206,314 @@ class SnafflerScanner:
 			print('Error processing %s: %s' % (obj, e))
 			return False
 
-	async def download_file(self, protocol_client: ProtocolClient, smbfile:SMBFile):
+	async def download_file(self, protocol_client: ProtocolClient, smbfile:SMBFile, target:str = None):
 		try:
+			# per-host concurrency is limited by the number of download workers
 			async with self.snaffler.total_dl_semaphore:
-				async with self.download_semaphore:
-					localpath = SMBFile.prepare_mirror_path(self.snaffler.download_base_dir, smbfile.unc_path)
-					localpath.mkdir(parents=True, exist_ok=True)
-					fpath, err = await protocol_client.donwload_file(smbfile, str(localpath), self.snaffler.max_file_size)
-					if err is not None:
-						return None, err
-					return fpath, None
+				localpath = SMBFile.prepare_mirror_path(self.snaffler.download_base_dir, smbfile.unc_path)
+				localpath.mkdir(parents=True, exist_ok=True)
+				start = time.perf_counter()
+				fpath, err = await protocol_client.donwload_file(smbfile, str(localpath), self.snaffler.max_file_size)
+				if err is not None:
+					return None, err
+				if fpath is not None:
+					self.snaffler.metrics.downloaded(target, min(smbfile.size, self.snaffler.max_file_size), time.perf_counter() - start)
+				return fpath, None
 		except Exception as e:
 			return None, e
 
-	async def process_file(self, protocol_client: ProtocolClient, smbfile:SMBFile, matchingrules:List[SnaffleRule], targetid:str, target:str, out_queue:asyncio.Queue):
-		fpath = None
-		keep_file = False
+	async def read_file_chunked(self, protocol_client: ProtocolClient, smbfile:SMBFile, max_size:int, keep:bytearray = None, target:str = None):
+		"""Reads the file in chunks under the download limits, the data read is also collected into keep if set"""
+		async with self.snaffler.total_dl_semaphore:
+			reader = protocol_client.read_file_chunked(smbfile, max_size)
+			try:
+				start = time.perf_counter()
+				async for data, err in reader:
+					if err is None and data:
+						self.snaffler.metrics.downloaded(target, len(data), time.perf_counter() - start, streamed = True)
+						if keep is not None:
+							keep += data
+					yield data, err
+					start = time.perf_counter()
+			finally:
+				await reader.aclose()
+
+	def save_file(self, smbfile:SMBFile, data:bytes):
+		"""Writes an in-memory file to the download directory"""
+		localpath = SMBFile.prepare_mirror_path(self.snaffler.download_base_dir, smbfile.unc_path)
+		localpath.mkdir(parents=True, exist_ok=True)
+		with open(localpath.joinpath(smbfile.name), 'wb') as f:
+			f.write(data)
+
+	def archive_member(self, smbfile:SMBFile, unc_path:str, size:int) -> SMBFile:
+		"""Returns the object a result belongs to, a synthetic SMBFile for archive members"""
+		if unc_path == smbfile.unc_path:
+			return smbfile
+		member = SMBFile.from_uncpath(unc_path)
+		member.unc_path = unc_path
+		member.size = size
+		member.last_write_time = smbfile.last_write_time
+		return member
+
+	async def process_file_streaming(self, protocol_client: ProtocolClient, smbfile:SMBFile, matchingrules:List[SnaffleRule], targetid:str, target:str, out_queue:asyncio.Queue):
+		"""Scans the file while it's being read, without writing it to disk.
+		Reading stops as soon as the scan budget is spent or every rule is decided.
+		Returns the (file, rule, data) results and the error, if any"""
+		found = []
+		read_error = None
 		try:
-			await out_queue.put(ScannerInfo(target, 'Downloading %s' % smbfile.unc_path))
-			fpath, err = await self.download_file(protocol_client, smbfile)
-			if err is not None:
-				await out_queue.put(ScannerInfo(target, 'Error downloading %s: %s' % (smbfile.unc_path, err)))
-				return
-			if fpath is None:
-				# file got skipped
-				return
-			await out_queue.put(ScannerInfo(target, 'Processing %s' % smbfile.unc_path))
-			async for data, rule, err in self.snaffler.ruleset.parse_file(fpath, matchingrules, smbfile.size, self.snaffler.chars_before_match, self.snaffler.chars_after_match):
+			max_size = self.snaffler.max_file_size
+			budget = self.read_budget(matchingrules)
+			if budget > 0:
+				max_size = budget
+			keep = bytearray() if self.snaffler.keep_files is True else None
+			reader = self.read_file_chunked(protocol_client, smbfile, max_size, keep, target)
+			self.send_info(target, out_queue, 'Processing %s' % smbfile.unc_path)
+			# deduplication needs the whole file before matching, only done for files that fit in memory anyway
+			cache = self.snaffler.content_cache if smbfile.size <= self.snaffler.in_memory_max_size else None
+			async for unc_path, size, res, rule, err in self.snaffler.ruleset.parse_archive(smbfile.unc_path, matchingrules, smbfile.size, self.snaffler.chars_before_match, self.snaffler.chars_after_match, reader = reader, first_match = self.snaffler.first_match, max_scan_bytes = self.snaffler.max_scan_bytes, pool = self.snaffler.get_match_pool(), cache = cache, limits = self.snaffler.get_archive_limits(), metrics = self.snaffler.metrics):
+				if err is not None:
+					read_error = err
+					continue
+				if res is None:
+					continue
+
+				obj = self.archive_member(smbfile, unc_path, size)
+				found.append((obj, rule, res))
+				await out_queue.put(ScannerData(target, SnafflerResult('file', obj, rule, res)))
+
+			if read_error is not None:
+				self.send_info(target, out_queue, 'Error reading %s: %s' % (smbfile.unc_path, read_error), sampled = False)
+			if len(found) > 0 and keep is not None:
+				# with an early stop this is only the part of the file that was scanned
+				self.save_file(smbfile, keep)
+			return found, read_error
+		except Exception as e:
+			print(e)
+			return found, e
+
+	def read_budget(self, matchingrules:List[SnaffleRule]) -> int:
+		"""Returns how many bytes of the file need to be read at most, 0 if the whole file is needed"""
+		budget = self.snaffler.ruleset.read_limit(matchingrules)
+		if self.snaffler.max_scan_bytes > 0 and self.snaffler.ruleset.is_archive(matchingrules) is False:
+			# archives can't be opened by their head
+			budget = self.snaffler.max_scan_bytes if budget == 0 else min(budget, self.snaffler.max_scan_bytes)
+		return budget
+
+	def is_streamed(self, smbfile:SMBFile, matchingrules:List[SnaffleRule]) -> bool:
+		"""True if the file is scanned while being read instead of downloaded first"""
+		if smbfile.size <= self.snaffler.in_memory_max_size or smbfile.size > self.snaffler.max_file_size:
+			return True
+		return self.snaffler.first_match is True or self.read_budget(matchingrules) > 0
+
+	async def match_file(self, smbfile:SMBFile, matchingrules:List[SnaffleRule], fpath:str, target:str, out_queue:asyncio.Queue):
+		"""Runs the rules on a downloaded file, deletes the file afterwards unless it needs to be kept.
+		Returns the (file, rule, data) results and the error, if any"""
+		found = []
+		parse_error = None
+		try:
+			self.send_info(target, out_queue, 'Processing %s' % smbfile.unc_path)
+			async for unc_path, size, data, rule, err in self.snaffler.ruleset.parse_archive(smbfile.unc_path, matchingrules, smbfile.size, self.snaffler.chars_before_match, self.snaffler.chars_after_match, filepath = fpath, pool = self.snaffler.get_match_pool(), cache = self.snaffler.content_cache, limits = self.snaffler.get_archive_limits(), metrics = self.snaffler.metrics):
 				if err is not None:
 					# error handling ?
+					parse_error = err
 					continue
 				if data is None:
 					continue
 				
-				keep_file = True
-				await out_queue.put(ScannerData(target, SnafflerResult('file', smbfile, rule, data)))
-			
+				obj = self.archive_member(smbfile, unc_path, size)
+				found.append((obj, rule, data))
+				await out_queue.put(ScannerData(target, SnafflerResult('file', obj, rule, data)))
+			return found, parse_error
 		except Exception as e:
 			print(e)
+			return found, e
 		finally:
-			if fpath is not None and (self.snaffler.keep_files is False or keep_file is False):
-				Path(fpath).unlink()	
-	
+			if self.snaffler.keep_files is False or len(found) == 0:
+				try:
+					Path(fpath).unlink(missing_ok=True)
+				except OSError as e:
+					print('Failed to remove %s: %s' % (fpath, e))
+
+	async def fetch_file(self, protocol_client: ProtocolClient, smbfile:SMBFile, matchingrules:List[SnaffleRule], targetid:str, target:str, out_queue:asyncio.Queue):
+		"""Downloads the file, returns the local path if it still needs to be matched.
+		Streamed files are scanned here, while they are being read, their results are returned as well.
+		Returns (local path, results, error)"""
+		if self.is_streamed(smbfile, matchingrules) is True:
+			found, err = await self.process_file_streaming(protocol_client, smbfile, matchingrules, targetid, target, out_queue)
+			return None, found, err
+		self.send_info(target, out_queue, 'Downloading %s' % smbfile.unc_path)
+		fpath, err = await self.download_file(protocol_client, smbfile, target)
+		if err is not None:
+			self.send_info(target, out_queue, 'Error downloading %s: %s' % (smbfile.unc_path, err), sampled = False)
+			return None, None, err
+		# fpath is None if the file got skipped
+		return fpath, None, None
+
+	async def process_file(self, protocol_client: ProtocolClient, smbfile:SMBFile, matchingrules:List[SnaffleRule], targetid:str, target:str, out_queue:asyncio.Queue):
+		fpath, found, err = await self.fetch_file(protocol_client, smbfile, matchingrules, targetid, target, out_queue)
+		if fpath is None:
+			return found, err
+		return await self.match_file(smbfile, matchingrules, fpath, target, out_queue)
+
+	def index_tag(self, matchingrules:List[SnaffleRule]) -> str:
+		"""Results stored in the scan index are only reused if the file was evaluated by the same rules with the same settings"""
+		return '%s|%s|%s|%s|%s' % (
+			','.join(sorted(rule.ruleName for rule in matchingrules)),
+			self.snaffler.chars_before_match,
+			self.snaffler.chars_after_match,
+			self.snaffler.first_match,
+			self.snaffler.max_scan_bytes,
+		)
+
+	def file_done(self, progress:HostProgress, node, smbfile:SMBFile, target:str, matchingrules:List[SnaffleRule], found, err):
+		"""Records a processed file in the journal, the scan index and the metrics, failed files are not journaled or indexed"""
+		self.snaffler.metrics.get_host(target).files += 1
+		if found is not None:
+			for _, rule, _ in found:
+				self.snaffler.metrics.rule_hit(rule.ruleName)
+		if progress is not None:
+			progress.file_done(node, journal_key(smbfile.unc_path), err is not None)
+		index = self.snaffler.get_index()
+		if index is not None and found is not None and err is None:
+			if any(obj is not smbfile for obj, _, _ in found):
+				# results of archive members are not indexed, the archive is processed again
+				return
+			results = [(rule.ruleName, data) for _, rule, data in found]
+			index.put(target, smbfile.unc_path.lower(), smbfile.size, get_last_write_time(smbfile), self.index_tag(matchingrules), results)
+
+	def safe_file_done(self, progress:HostProgress, node, smbfile:SMBFile, target:str, matchingrules:List[SnaffleRule], found, err):
+		"""file_done for the workers, a failure (eg. of the journal or the index) must not stop the worker,
+		the other workers would wait on its queue forever"""
+		try:
+			self.file_done(progress, node, smbfile, target, matchingrules, found, err)
+		except Exception as e:
+			print('Error recording %s: %s' % (smbfile.unc_path, e))
+
+	async def download_worker(self, protocol_client: ProtocolClient, download_queue:asyncio.Queue, match_queue:asyncio.Queue, targetid:str, target:str, out_queue:asyncio.Queue, progress:HostProgress = None):
+		"""Downloads the files queued by the enumeration and passes them to the matching stage"""
+		while True:
+			item = await download_queue.get()
+			if item is None:
+				return
+			smbfile, matchingrules, node = item
+			found, err = None, None
+			try:
+				fpath, found, err = await self.fetch_file(protocol_client, smbfile, matchingrules, targetid, target, out_queue)
+				if fpath is not None:
+					await match_queue.put((smbfile, matchingrules, fpath, node))
+					continue
+			except Exception as e:
+				print(e)
+				err = e
+			self.safe_file_done(progress, node, smbfile, target, matchingrules, found, err)
+
+	async def match_worker(self, match_queue:asyncio.Queue, target:str, out_queue:asyncio.Queue, progress:HostProgress = None):
+		"""Runs the rules on the files downloaded by the download workers"""
+		while True:
+			item = await match_queue.get()
+			if item is None:
+				return
+			smbfile, matchingrules, fpath, node = item
+			found, err = None, None
+			try:
+				found, err = await self.match_file(smbfile, matchingrules, fpath, target, out_queue)
+			except Exception as e:
+				print('Error matching %s: %s' % (smbfile.unc_path, e))
+				err = e
+			self.safe_file_done(progress, node, smbfile, target, matchingrules, found, err)
+
 	async def snaffle_machine(self, protocol_client: ProtocolClient, targetid:str, target:str, out_queue:asyncio.Queue):
-		async for obj, otype, err in protocol_client.enum_files_with_filter(self.__filter_share_and_dir):
+		# enumeration -> download workers -> matching, each stage is connected by a bounded queue
+		# so the enumeration can't get too far ahead of the downloads
+		worker_count = max(self.snaffler.max_downloads, 1)
+		# progress is journaled per host, files and directories finished in a previous run are skipped
+		progress = None
+		journal = self.snaffler.get_journal()
+		if journal is not None:
+			progress = journal.open_host(target)
+		download_queue = asyncio.Queue(worker_count * QUEUE_SIZE_PER_WORKER)
+		match_queue = asyncio.Queue(worker_count)
+		self.snaffler.metrics.add_queue('download', target, download_queue)
+		self.snaffler.metrics.add_queue('match', target, match_queue)
+		download_workers = []
+		for _ in range(worker_count):
+			download_workers.append(asyncio.create_task(self.download_worker(protocol_client, download_queue, match_queue, targetid, target, out_queue, progress)))
+		# with a matching pool more than one file of the host can be matched at once
+		match_workers = []
+		for _ in range(max(min(self.snaffler.match_workers, worker_count), 1)):
+			match_workers.append(asyncio.create_task(self.match_worker(match_queue, target, out_queue, progress)))
+		try:
+			await self.enum_machine(protocol_client, download_queue, targetid, target, out_queue, progress)
+			if progress is not None:
+				progress.finish()
+			for _ in download_workers:
+				await download_queue.put(None)
+			await asyncio.gather(*download_workers)
+			for _ in match_workers:
+				await match_queue.put(None)
+			await asyncio.gather(*match_workers)
+			if progress is not None and progress.failed is False:
+				journal.host_done(target)
+		finally:
+			self.snaffler.metrics.remove_queue('download', target)
+			self.snaffler.metrics.remove_queue('match', target)
+			for task in download_workers + match_workers:
+				task.cancel()
+			# files that got downloaded but never matched (eg. on host timeout) are not kept
+			while match_queue.empty() is False:
+				item = match_queue.get_nowait()
+				if item is not None:
+					Path(item[2]).unlink(missing_ok=True)
+			await protocol_client.close()
+
+	async def enum_machine(self, protocol_client: ProtocolClient, download_queue:asyncio.Queue, targetid:str, target:str, out_queue:asyncio.Queue, progress:HostProgress = None):
+		async def filter_cb(otype, obj):
+			return await self.__filter_share_and_dir(otype, obj, progress)
+
+		index = self.snaffler.get_index()
+		metrics = self.snaffler.metrics
+		host = metrics.get_host(target)
+		async for obj, otype, err in protocol_client.enum_files_with_filter(filter_cb):
 			if err is not None:
 				#print(err)
+				if progress is not None:
+					progress.error()
 				continue
+			host.objects += 1
+			node = None
+			if progress is not None and otype in ('file', 'dir'):
+				key = journal_key(obj.unc_path)
+				node = progress.enter(key, otype)
+				if otype == 'file' and progress.is_file_done(key) is True:
+					continue
 			if self.snaffler.gen_filelist is True:
-				await out_queue.put(ScannerData(target, SMBFileRes(obj, otype, None)))
+				await out_queue.put(ScannerData(target, SnafflerFileListEntry(otype, obj)))
 
 			if otype == 'file':
 				
+				start = time.perf_counter()
 				tograb, matchingrules = self.snaffler.ruleset.enum_file(obj)
+				metrics.rule_scope('file', time.perf_counter() - start)
 				if tograb is False:
 					continue
 				
-				if obj.size > self.snaffler.max_file_size:
+				if index is not None:
+					# unchanged since the last scan, the stored results are re-emitted instead of processing the file again
+					results = await index.get_async(target, obj.unc_path.lower(), obj.size, get_last_write_time(obj), self.index_tag(matchingrules))
+					if results is not None and all(rulename in self.snaffler.ruleset.allRules for rulename, _ in results):
+						self.snaffler.stat_findexed += 1
+						for rulename, data in results:
+							await out_queue.put(ScannerData(target, SnafflerResult('file', obj, self.snaffler.ruleset.allRules[rulename], data)))
+						continue
+
+				budget = self.read_budget(matchingrules)
+				if obj.size > self.snaffler.max_file_size and budget == 0:
 					self.snaffler.stat_flarge += 1
 					for rule in matchingrules:
+						if rule.matchLocation == MatchLoc.FileMD5:
+							# matches every file, only its digest could tell
+							continue
 						await out_queue.put(ScannerData(target, SnafflerResult('file', obj, rule, 'Skipped due to file size constraints')))
 					
 					continue
@@ -146,33 +521,46 @@ class SnafflerScanner:
 					continue
 
 				self.snaffler.stat_fcnt += 1
-				self.snaffler.stat_fsize += obj.size
+				if budget > 0:
+					self.snaffler.stat_fsize += min(obj.size, budget)
+				else:
+					self.snaffler.stat_fsize += obj.size
 
 				if self.snaffler.dry_run is True:
 					continue
 
-				await self.process_file(protocol_client, obj, matchingrules, targetid, target, out_queue)
+				if progress is not None:
+					progress.file_queued(node)
+				await download_queue.put((obj, matchingrules, node))
 			elif otype == 'dir':
 				# at this point it sure matches to at least one rule
 				tograb, rules = self.snaffler.ruleset.enum_directory(obj.fullpath)
 				if tograb is False:
 					continue
 				for rule in rules:
+					metrics.rule_hit(rule.ruleName)
 					await out_queue.put(ScannerData(target, SnafflerResult('dir', obj, rule)))
 			if otype == 'share':
 				tograb, rules = self.snaffler.ruleset.enum_share(obj.name)
 				if tograb is False:
 					continue
 				for rule in rules:
+					metrics.rule_hit(rule.ruleName)
 					await out_queue.put(ScannerData(target, SnafflerResult('share', obj, rule)))
 	
 	async def run(self, targetid, target, out_queue:asyncio.Queue):
 		try:
+			journal = self.snaffler.get_journal()
+			if journal is not None and journal.is_host_done(target) is True:
+				self.send_info(target, out_queue, 'Skipping, already scanned', sampled = False)
+				return
 			if isinstance(self.factory, NFS3ConnectionFactory):
 				protocol_client = NFSProtocolClient(self.factory, target)
 			else:
 				protocol_client = SMBProtocolClient(self.factory, target)
 			
+			self.snaffler.metrics.host_started(target)
+			self.snaffler.metrics.add_queue('out', self.__class__.__name__, out_queue)
 			await protocol_client.connect_to_target(target)
 			await self.snaffle_machine(protocol_client, targetid, target, out_queue)
 				
@@ -180,3 +568,6 @@ class SnafflerScanner:
 			return
 		except Exception as e:
 			await out_queue.put(ScannerError(target, e))
+		finally:
+			self.info_last.pop(target, None)
+			self.snaffler.metrics.host_finished(target)
@@ -1,15 +1,29 @@
 import asyncio
 from pysnaffler.ruleset import SnafflerRuleSet
-from pysnaffler.utils import sizeof_fmt
+from pysnaffler.matchpool import SnafflerMatchPool
+from pysnaffler.journal import SnafflerJournal
+from pysnaffler.scanindex import SnafflerScanIndex
+from pysnaffler.metrics import SnafflerMetrics
+from pysnaffler.archive import ArchiveLimits, ARCHIVE_MAX_DEPTH, ARCHIVE_MAX_TOTAL_SIZE
+from pysnaffler.utils import sizeof_fmt, LRUCache
 from typing import List
 import toml
 import os
 
+# results waiting to be written, enumeration blocks when the output queue is full
+OUT_QUEUE_SIZE = 10000
+# seconds between progress messages ('Processing ...') of a host
+INFO_INTERVAL = 1
+
 class pySnaffler:
 	def __init__(self, ruleset:SnafflerRuleSet = None, max_file_size:int = 10485760, max_connections:int = 200, 
 					max_downloads:int = 4, max_downloads_total:int = 20, keep_files:bool = False, 
 					download_base_dir:str = './snaffler_downloads', dry_run:bool = False, gen_filelist:bool = False,
-					chars_before_match:int = 0, chars_after_match:int = 0, nfs:bool = False):
+					chars_before_match:int = 0, chars_after_match:int = 0, nfs:bool = False, in_memory_max_size:int = 0,
+					first_match:bool = False, max_scan_bytes:int = 0, match_workers:int = 0, match_backend:str = 'process',
+					journal_path:str = None, resume:bool = False, index_path:str = None,
+					content_cache_size:int = 0, archive_max_size:int = ARCHIVE_MAX_TOTAL_SIZE, archive_max_depth:int = ARCHIVE_MAX_DEPTH,
+					out_queue_size:int = OUT_QUEUE_SIZE, info_interval:float = INFO_INTERVAL, profile_rules:bool = False):
 		self.ruleset = ruleset
 		self.download_base_dir = download_base_dir
 		self.max_file_size = max_file_size
@@ -22,17 +36,114 @@ class pySnaffler:
 		self.chars_before_match = chars_before_match
 		self.chars_after_match = chars_after_match
 		self.nfs = nfs
+		# files up to this size are scanned while being read instead of being downloaded first, 0 disables it
+		self.in_memory_max_size = in_memory_max_size
+		# contents rules stop at their first match
+		self.first_match = first_match
+		# only this many bytes of a file are scanned, larger files are scanned by their head. 0 means no limit
+		self.max_scan_bytes = max_scan_bytes
+		# number of workers running the contents matching outside of the event loop, 0 runs it in the event loop
+		self.match_workers = match_workers
+		self.match_backend = match_backend
+		self.__match_pool = None
+		# scan progress is recorded here, with resume the hosts/directories/files finished in the previous run are skipped
+		self.journal_path = journal_path
+		self.resume = resume
+		self.__journal = None
+		# files unchanged since the scan recorded in the index are not processed again, their results are re-emitted
+		self.index_path = index_path
+		self.__index = None
+		# contents rules results of this many distinct file contents (by hash) are remembered, 0 disables deduplication
+		self.content_cache_size = content_cache_size
+		self.content_cache = LRUCache(content_cache_size) if content_cache_size > 0 else None
+		# limits for archives opened by EnterArchive rules: total uncompressed bytes and nesting depth
+		self.archive_max_size = archive_max_size
+		self.archive_max_depth = archive_max_depth
+		# capacity of the output queue, 0 means unbounded
+		self.out_queue_size = out_queue_size
+		# progress messages are sampled, a host sends at most one per this many seconds. 0 sends all of them
+		self.info_interval = info_interval
+		# every pattern of every rule is timed, the slowest ones are listed by print_stats
+		self.profile_rules = profile_rules
+		if self.profile_rules is True and self.ruleset is not None:
+			self.ruleset.enable_profiling()
 		self.stat_fcnt = 0
 		self.stat_fsize = 0
 		self.stat_flarge = 0
+		self.stat_findexed = 0
+		self.stat_info_sampled = 0
+		self.stat_info_dropped = 0
+		# per stage counters and timings of the scan
+		self.metrics = SnafflerMetrics()
 		self.total_dl_semaphore = asyncio.Semaphore(self.max_downloads_total)
 
+	def get_match_pool(self) -> SnafflerMatchPool:
+		"""Returns the contents matching pool, None if matching runs in the event loop"""
+		if self.match_workers <= 0:
+			return None
+		if self.__match_pool is None:
+			self.__match_pool = SnafflerMatchPool(self.ruleset, self.match_workers, self.match_backend)
+		return self.__match_pool
+
+	def get_journal(self) -> SnafflerJournal:
+		"""Returns the scan journal, None if journaling is disabled. Dry runs are not journaled"""
+		if self.journal_path is None or self.dry_run is True:
+			return None
+		if self.__journal is None:
+			self.__journal = SnafflerJournal(self.journal_path, self.resume)
+		return self.__journal
+
+	def get_index(self) -> SnafflerScanIndex:
+		"""Returns the incremental scan index, None if it's disabled"""
+		if self.index_path is None:
+			return None
+		if self.__index is None:
+			self.__index = SnafflerScanIndex(self.index_path)
+		return self.__index
+
+	def get_archive_limits(self) -> ArchiveLimits:
+		"""Returns a new set of limits, every archive gets its own"""
+		return ArchiveLimits(self.archive_max_depth, self.archive_max_size)
+
+	def close(self):
+		if self.__match_pool is not None:
+			self.__match_pool.close()
+			self.__match_pool = None
+		if self.__journal is not None:
+			self.__journal.close()
+			self.__journal = None
+		if self.__index is not None:
+			self.__index.close()
+			self.__index = None
+
 	def print_stats(self):
 		if self.dry_run:
 			print('Total files would\'ve been downloaded: %s Totaling %s Skipped %s files because of size constraints' % (self.stat_fcnt, sizeof_fmt(self.stat_fsize), self.stat_flarge))
+			self.print_cache_stats()
+			self.print_rule_profile()
 			return
 		
 		print('Total files downloaded: %s Totaling %s Skipped %s files because of size constraints' % (self.stat_fcnt, sizeof_fmt(self.stat_fsize), self.stat_flarge))
+		self.print_cache_stats()
+		self.metrics.print_summary()
+		self.print_rule_profile()
+
+	def print_rule_profile(self):
+		if self.ruleset is None or self.ruleset.profiler is None:
+			return
+		self.ruleset.profiler.print_report(warnings = self.ruleset.lint())
+
+	def print_cache_stats(self):
+		if self.stat_info_sampled > 0 or self.stat_info_dropped > 0:
+			print('Info messages: %s skipped by sampling, %s dropped because the output queue was full' % (self.stat_info_sampled, self.stat_info_dropped))
+		if self.index_path is not None:
+			print('Unchanged files taken from the scan index: %s' % self.stat_findexed)
+		if self.content_cache is not None:
+			print('Content deduplication cache: %s hits %s misses %s entries' % (self.content_cache.hits, self.content_cache.misses, len(self.content_cache)))
+		if self.ruleset is None:
+			return
+		for name, cache in [('Share', self.ruleset.shareCache), ('Directory', self.ruleset.directoryCache)]:
+			print('%s decision cache: %s hits %s misses %s entries' % (name, cache.hits, cache.misses, len(cache)))
 
 	def to_dict(self):
 		return {
@@ -47,7 +158,21 @@ class pySnaffler:
 			'gen_filelist' : self.gen_filelist,
 			'chars_before_match': self.chars_before_match,
 			'chars_after_match': self.chars_after_match,
-			'nfs': self.nfs
+			'nfs': self.nfs,
+			'in_memory_max_size': self.in_memory_max_size,
+			'first_match': self.first_match,
+			'max_scan_bytes': self.max_scan_bytes,
+			'match_workers': self.match_workers,
+			'match_backend': self.match_backend,
+			'journal_path': self.journal_path,
+			'resume': self.resume,
+			'index_path': self.index_path,
+			'content_cache_size': self.content_cache_size,
+			'archive_max_size': self.archive_max_size,
+			'archive_max_depth': self.archive_max_depth,
+			'out_queue_size': self.out_queue_size,
+			'info_interval': self.info_interval,
+			'profile_rules': self.profile_rules,
 		}
 
 	def to_toml(self):
@@ -69,18 +194,32 @@ class pySnaffler:
 		else:
 			d['ruleset'] = SnafflerRuleSet.from_dict(d['ruleset'])
 		return pySnaffler(
-			d['ruleset'],
-			d['download_base_dir'],
-			d['max_file_size'],
-			d['max_connections'],
-			d['max_downloads'],
-			d['max_downloads_total'],
-			d['keep_files'],
-			d['dry_run'],
-			d['gen_filelist'],
-			d['chars_before_match'],
-			d['chars_after_match'],
-			d['nfs']
+			ruleset = d['ruleset'],
+			download_base_dir = d['download_base_dir'],
+			max_file_size = d['max_file_size'],
+			max_connections = d['max_connections'],
+			max_downloads = d['max_downloads'],
+			max_downloads_total = d['max_downloads_total'],
+			keep_files = d['keep_files'],
+			dry_run = d['dry_run'],
+			gen_filelist = d['gen_filelist'],
+			chars_before_match = d['chars_before_match'],
+			chars_after_match = d['chars_after_match'],
+			nfs = d['nfs'],
+			in_memory_max_size = d.get('in_memory_max_size', 0),
+			first_match = d.get('first_match', False),
+			max_scan_bytes = d.get('max_scan_bytes', 0),
+			match_workers = d.get('match_workers', 0),
+			match_backend = d.get('match_backend', 'process'),
+			journal_path = d.get('journal_path'),
+			resume = d.get('resume', False),
+			index_path = d.get('index_path'),
+			content_cache_size = d.get('content_cache_size', 0),
+			archive_max_size = d.get('archive_max_size', ARCHIVE_MAX_TOTAL_SIZE),
+			archive_max_depth = d.get('archive_max_depth', ARCHIVE_MAX_DEPTH),
+			out_queue_size = d.get('out_queue_size', OUT_QUEUE_SIZE),
+			info_interval = d.get('info_interval', INFO_INTERVAL),
+			profile_rules = d.get('profile_rules', False),
 		)
 
 	@staticmethod
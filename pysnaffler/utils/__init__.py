@@ -1,3 +1,7 @@
+import time
+import datetime
+from collections import OrderedDict
+
 
 # https://stackoverflow.com/questions/1094841/get-human-readable-version-of-file-size
 def sizeof_fmt(num, suffix='B'):
@@ -7,4 +11,55 @@ def sizeof_fmt(num, suffix='B'):
 		if abs(num) < 1024.0:
 			return "%3.1f%s%s" % (num, unit, suffix)
 		num /= 1024.0
-	return "%.1f%s%s" % (num, 'Yi', suffix)
\ No newline at end of file
+	return "%.1f%s%s" % (num, 'Yi', suffix)
+
+# (second, formatted) of the last utc_timestamp call
+_timestamp_cache = [None, '']
+
+def utc_timestamp() -> str:
+	"""Current UTC time in ISO format with second precision, only formatted once per second"""
+	now = int(time.time())
+	if now != _timestamp_cache[0]:
+		_timestamp_cache[0] = now
+		_timestamp_cache[1] = datetime.datetime.utcfromtimestamp(now).isoformat()
+	return _timestamp_cache[1]
+
+class LRUCache:
+	"""Bounded dict that evicts the least recently used entry, counts hits and misses"""
+	def __init__(self, maxsize:int = 65536):
+		self.maxsize = maxsize
+		self.data = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key, default = None):
+		try:
+			value = self.data[key]
+		except KeyError:
+			self.misses += 1
+			return default
+		self.data.move_to_end(key)
+		self.hits += 1
+		return value
+
+	def put(self, key, value):
+		self.data[key] = value
+		self.data.move_to_end(key)
+		if len(self.data) > self.maxsize:
+			self.data.popitem(last = False)
+
+	def clear(self):
+		self.data.clear()
+
+	def __contains__(self, key):
+		return key in self.data
+
+	def __len__(self):
+		return len(self.data)
+
+	def stats(self):
+		return {
+			'size' : len(self.data),
+			'hits' : self.hits,
+			'misses' : self.misses,
+		}
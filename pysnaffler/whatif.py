@@ -4,16 +4,143 @@ import logging
 from aiosmb.commons.connection.factory import SMBConnectionFactory
 from pysnaffler.snaffler import pySnaffler
 from pysnaffler.ruleset import SnafflerRuleSet
+from pysnaffler import matchpool
 from aiosmb import logger
+from typing import Dict, List, Tuple
+from concurrent.futures import ProcessPoolExecutor
 
 from tqdm import tqdm
 import datetime
-import codecs
 import traceback
 import sys
+import os
+
+# the listing is read and evaluated in blocks of this size
+BLOCK_SIZE = 16*1024*1024
+# target files are split into shards of about this size for the worker processes
+SHARD_SIZE = 64*1024*1024
+
+def read_blocks(f, blocksize:int = BLOCK_SIZE, limit:int = None):
+	"""Yields (lines, bytes consumed) from a binary file, only complete lines are returned in a block.
+	If limit is set reading stops after limit bytes"""
+	leftover = b''
+	while True:
+		if limit is not None:
+			block = f.read(min(blocksize, limit))
+			limit -= len(block)
+		else:
+			block = f.read(blocksize)
+		if not block:
+			if leftover:
+				yield [leftover.decode('latin-1')], len(leftover)
+			return
+		block = leftover + block
+		end = block.rfind(b'\n')
+		if end == -1:
+			leftover = block
+			continue
+		leftover = block[end+1:]
+		yield block[:end].decode('latin-1').split('\n'), end + 1
+
+def parse_line(line:str, is_aiosmb:bool = False):
+	"""Returns (unc path, file size) for file lines of a listing, None for anything else"""
+	try:
+		line = line.strip()
+		if line == '':
+			return None
+		if is_aiosmb is True:
+			_, _, otype, uncpath, *rest = line.split('\t')
+			if otype != 'file':
+				return None
+			try:
+				fsize = rest[1]
+			except:
+				print('Error on line %s' % line)
+				fsize = 0
+		else:
+			_, otype, uncpath, *rest = line.split('\t')
+			if otype != 'file':
+				return None
+			fsize = rest[1]
+		return uncpath, int(fsize)
+	except Exception as e:
+		print('Error processing %s: %s' % (line, e))
+		traceback.print_exc()
+		return None
 			
 
-async def whatif(targets, config = None, rulesdir = None, url = None, is_aiosmb = False):
+def shard_file(path:str, shard_size:int = SHARD_SIZE, min_shards:int = 1) -> List[Tuple[int, int]]:
+	"""Splits the file into (start, end) byte ranges, every range ends on a line boundary"""
+	fsize = os.path.getsize(path)
+	count = max(min_shards, -(-fsize // shard_size), 1)
+	bounds = [0]
+	with open(path, 'rb') as f:
+		for i in range(1, count):
+			pos = max(fsize * i // count, bounds[-1])
+			if pos >= fsize:
+				break
+			f.seek(pos)
+			f.readline()
+			if f.tell() > bounds[-1] and f.tell() < fsize:
+				bounds.append(f.tell())
+	bounds.append(fsize)
+	return [(bounds[i], bounds[i+1]) for i in range(len(bounds) - 1)]
+
+class WhatifResult:
+	def __init__(self):
+		self.files_to_dl:List[Tuple[str, int, str]] = []
+		self.total_dl_size = 0
+		self.rulecounts:Dict[str, int] = {}
+		self.profile = None # rule profile collected by a worker, see SnafflerRuleProfiler.take
+
+	def merge(self, other:'WhatifResult'):
+		self.files_to_dl += other.files_to_dl
+		self.total_dl_size += other.total_dl_size
+		for name in other.rulecounts:
+			self.rulecounts[name] = self.rulecounts.get(name, 0) + other.rulecounts[name]
+
+def evaluate_range(ruleset:SnafflerRuleSet, path:str, start:int, end:int, is_aiosmb:bool = False, progress = None) -> WhatifResult:
+	"""Runs the ruleset on the listing lines between the start and end byte offsets"""
+	result = WhatifResult()
+	with open(path, 'rb') as f:
+		f.seek(start)
+		for lines, blocksize in read_blocks(f, limit = end - start):
+			entries = []
+			for line in lines:
+				entry = parse_line(line, is_aiosmb)
+				if entry is not None:
+					entries.append(entry)
+
+			for (uncpath, fsize), (todl, rules, err) in zip(entries, ruleset.enum_unc_batch(entries)):
+				if err is not None:
+					print('Error processing %s: %s' % (uncpath, err))
+					continue
+				if todl is False:
+					continue
+				result.total_dl_size += fsize
+				for r in rules:
+					result.rulecounts[r.ruleName] = result.rulecounts.get(r.ruleName, 0) + 1
+				rulenames = ','.join([r.ruleName for r in rules])
+				result.files_to_dl.append((uncpath, fsize, rulenames))
+			if progress is not None:
+				progress(blocksize)
+	return result
+
+def evaluate_shard(path:str, start:int, end:int, is_aiosmb:bool = False) -> WhatifResult:
+	"""evaluate_range in a worker process, using the ruleset the pool was initialized with"""
+	result = evaluate_range(matchpool.worker_ruleset, path, start, end, is_aiosmb)
+	result.profile = matchpool.take_profile()
+	return result
+
+def print_result(target:str, result:WhatifResult, elapsed):
+	print('Results for %s' % target)
+	print('Took %s to process' % elapsed)
+	print('Total files to download: %s' % len(result.files_to_dl))
+	print('Total size to download: %s' % result.total_dl_size)
+	for name, count in sorted(result.rulecounts.items(), key=lambda x: x[1], reverse=True):
+		print('\t%s: %s' % (name, count))
+
+async def whatif(targets, config = None, rulesdir = None, url = None, is_aiosmb = False, workers:int = 1, profile:bool = False):
 	logger.setLevel(logging.CRITICAL)
 
 	if len(targets) == 0:
@@ -24,9 +151,12 @@ async def whatif(targets, config = None, rulesdir = None, url = None, is_aiosmb
 	if url is not None:
 		connectionfactory = SMBConnectionFactory.from_url(url)
 	
-	ruleset = SnafflerRuleSet.load_default_ruleset()
 	if rulesdir is not None:
 		ruleset = SnafflerRuleSet.from_directory(rulesdir)
+	else:
+		ruleset = SnafflerRuleSet.load_default_ruleset()
+	if profile is True:
+		ruleset.enable_profiling()
 	
 	snaffler = pySnaffler(ruleset, dry_run=True)
 	if config is not None:
@@ -36,70 +166,46 @@ async def whatif(targets, config = None, rulesdir = None, url = None, is_aiosmb
 	
 	print('Running config:')
 	print(snaffler.to_toml())
-	
-	for target in targets:
-		total_dl_size = 0
-		files_to_dl = []
-		print('Processing %s' % target)
+
+	if workers is None or workers <= 1:
+		for target in targets:
+			print('Processing %s' % target)
+			estart = datetime.datetime.now()
+			with tqdm(total=os.path.getsize(target), unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+				result = evaluate_range(ruleset, target, 0, os.path.getsize(target), is_aiosmb, pbar.update)
+			print_result(target, result, datetime.datetime.now() - estart)
+		if ruleset.profiler is not None:
+			ruleset.profiler.print_report(warnings = ruleset.lint())
+		return
+
+	# all shards of all targets share the same pool, every worker holds its own copy of the ruleset
+	estart = datetime.datetime.now()
+	loop = asyncio.get_running_loop()
+	results = [WhatifResult() for _ in targets]
+	with ProcessPoolExecutor(workers, initializer = matchpool.init_worker, initargs = (ruleset.pickle(), profile)) as executor:
+		jobs = []
 		total = 0
-		estart = datetime.datetime.now()
-		with codecs.open(target, 'r','latin-1') as f:
-			if is_aiosmb is True:
-				for line in f:
-					line = line.strip()
-					if line == '':
-						continue
-					_, _, otype, *rest = line.split('\t')
-					if otype != 'file':
-						continue
-					total += 1
-			else:
-				for line in f:
-					total += 1
-		eend = datetime.datetime.now()
-		print('Took %s to count lines' % (eend-estart))
-
-		estart = datetime.datetime.now()
-		with codecs.open(target, 'r','latin-1') as f:
-			for line in tqdm(f, total=total):
-				try:
-					line = line.strip()
-					if line == '':
-						continue
-					if is_aiosmb is True:
-						_, _, otype, uncpath, *rest = line.split('\t')
-						if otype != 'file':
-							continue
-						try:
-							fsize = rest[1]
-						except:
-							print('Error on line %s' % line)
-							fsize = 0
-					else:
-						_, otype, uncpath, *rest = line.split('\t')
-						if otype != 'file':
-							continue
-						fsize = rest[1]
-					
-					todl, rules = ruleset.enum_unc(uncpath, fsize)
-					if todl is False:
-						continue
-					
-					total_dl_size += int(fsize)
-					rulenames = ','.join([r.ruleName for r in rules])
-					files_to_dl.append((uncpath, fsize, rulenames))
-				except Exception as e:
-					print('Error processing %s: %s' % (line, e))
-					traceback.print_exc()
-					continue
-		
-		eend = datetime.datetime.now()
-		print('Took %s to process' % (eend-estart))
-		print('Total files to download: %s' % len(files_to_dl))
-		print('Total size to download: %s' % total_dl_size)
-	
-	
-	#snaffler.print_stats()
+		for tid, target in enumerate(targets):
+			for start, end in shard_file(target, min_shards = workers):
+				jobs.append(run_shard(loop, executor, tid, target, start, end, is_aiosmb))
+				total += end - start
+		print('Processing %s targets in %s shards with %s workers' % (len(targets), len(jobs), workers))
+		with tqdm(total=total, unit='B', unit_scale=True, unit_divisor=1024) as pbar:
+			for job in asyncio.as_completed(jobs):
+				tid, size, result = await job
+				results[tid].merge(result)
+				if result.profile is not None:
+					ruleset.profiler.merge(result.profile)
+				pbar.update(size)
+	elapsed = datetime.datetime.now() - estart
+	for tid, target in enumerate(targets):
+		print_result(target, results[tid], elapsed)
+	if ruleset.profiler is not None:
+		ruleset.profiler.print_report(warnings = ruleset.lint())
+
+async def run_shard(loop, executor, tid:int, target:str, start:int, end:int, is_aiosmb:bool):
+	result = await loop.run_in_executor(executor, evaluate_shard, target, start, end, is_aiosmb)
+	return tid, end - start, result
 
 async def amain():
 	import argparse
@@ -109,10 +215,12 @@ async def amain():
 	parser.add_argument('-r', '--rules', help='Path to rules directory. Overrides all other options.')
 	parser.add_argument('--aiosmb', action='store_true', help='Targets are in aiosmb format')
 	parser.add_argument('--url', help = 'Connection string in URL format')
+	parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='Number of worker processes. 1 processes the targets one by one in this process')
+	parser.add_argument('--profile-rules', action='store_true', help='Time every pattern of every rule, prints the slowest ones and the patterns prone to backtracking at the end')
 	parser.add_argument('targets', nargs='*', help = 'File containing a list of UNC file paths in "\\\\server\\share\\path\\file" format. One per line. Optionally, a file size can be appended to the line, separated by a tab. Example: "\\\\server\\share\\path\\file\t123456"')
 	args = parser.parse_args()
 
-	await whatif(args.targets, args.config, args.rules, args.url, args.aiosmb)
+	await whatif(args.targets, args.config, args.rules, args.url, args.aiosmb, args.workers, args.profile_rules)
 
 
 def main():
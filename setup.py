@@ -22,7 +22,7 @@ setup(
 	author_email="info@skelsecprojects.com",
 
 	# Packages
-	packages=find_packages(),
+	packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
 
 	# Include additional files into the package
 	include_package_data=True,
@@ -43,6 +43,10 @@ setup(
 		'anfs>=0.0.3',
 		'toml',
 	],
+	extras_require={
+		'7z': ['py7zr>=0.20,<2'],
+		'parquet': ['pyarrow'],
+	},
 	
 	classifiers=[
 		"Programming Language :: Python :: 3.7",